@@ -0,0 +1,34 @@
+import functools
+import os
+import threading
+
+import boto3
+
+# botocore sessions are not thread safe: clients and resources are created one at a time.
+# Reentrant, as resource() calls client().
+_create_lock = threading.RLock()
+
+
+class SharedSession(boto3.Session):
+    """boto3 Session shared by the whole process
+
+    Credentials and service models are loaded once, and clients can be created from any thread.
+    """
+
+    def client(self, *args, **kwargs):
+        with _create_lock:
+            return super().client(*args, **kwargs)
+
+    def resource(self, *args, **kwargs):
+        with _create_lock:
+            return super().resource(*args, **kwargs)
+
+
+@functools.cache
+def _get_region_session(region: str) -> SharedSession:
+    return SharedSession(region_name=region)
+
+
+def get_boto_session(region: str | None = None) -> SharedSession:
+    """Session of a region (AWS_REGION by default), reused by every request"""
+    return _get_region_session(region or os.environ["AWS_REGION"])
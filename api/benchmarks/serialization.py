@@ -0,0 +1,73 @@
+"""Benchmark of reading and returning the messages of a 500-message chat
+
+Compares validating the items with MessageInTableList against one model at a time and against
+the trusted construction without validation (model_construct). Run from the api directory:
+    python -m benchmarks.serialization
+"""
+
+import timeit
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from models import MessageInTable, MessageInTableList
+from responses import FastJSONResponse
+
+MESSAGE_COUNT = 500
+REPEAT = 20
+
+
+def build_items(count: int) -> list[dict]:
+    """Message items shaped like the ones returned by get_messages_from_db"""
+    items = []
+
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = [{"text": f"Message {i}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20}]
+
+        if role == "user" and i % 10 == 0:
+            content.append({"image": "png", "s3Key": f"user/{i}.png"})
+
+        items.append(
+            {
+                "queryId": "chat$message",
+                "orderBy": f"{1700000000000 + i}0000000000000000",
+                "resourceId": f"message-{i}",
+                "dataType": "message",
+                "userId": "user",
+                "role": role,
+                "content": content,
+                "tools": ["webSearch"] if role == "user" else None,
+                # Numbers come back from DynamoDB as Decimal
+                "inputTokens": Decimal(i),
+            }
+        )
+
+    return items
+
+
+def measure(name: str, func) -> float:
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f"{name:<48} {seconds * 1000:8.2f} ms")
+    return seconds
+
+
+def main():
+    items = build_items(MESSAGE_COUNT)
+
+    print(f"{MESSAGE_COUNT} messages, best of {REPEAT} runs")
+
+    validated = measure("MessageInTable(**item)", lambda: [MessageInTable(**x) for x in items])
+    constructed = measure("MessageInTable.model_construct(**item)", lambda: [MessageInTable.model_construct(**x) for x in items])
+    adapted = measure("MessageInTableList.validate_python(items)", lambda: MessageInTableList.validate_python(items))
+    print(f"{'  faster than MessageInTable(**item)':<48} {validated / adapted:8.1f} x")
+    print(f"{'  faster than model_construct':<48} {constructed / adapted:8.1f} x")
+
+    default = measure("jsonable_encoder + JSONResponse", lambda: JSONResponse(jsonable_encoder(items)).body)
+    fast = measure("FastJSONResponse", lambda: FastJSONResponse(items).body)
+    print(f"{'':<48} {default / fast:8.1f} x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from config import CHAT_RETENTION_DAYS, LIST_VERSION_TTL_SECONDS, TOOL_RESULT_CACHE_MAX_BYTES
+
+# Maximum number of list pages kept in memory per process
+LIST_CACHE_MAX_ENTRIES = 1024
+
+# Browsers keep the response but always revalidate it with If-None-Match
+LIST_CACHE_CONTROL = "private, no-cache"
+
+_list_cache: OrderedDict[tuple, dict] = OrderedDict()
+_list_cache_lock = threading.Lock()
+
+# (x_user_sub, list_type) -> (time.monotonic() of the read, version)
+_list_versions: OrderedDict[tuple[str, str], tuple[float, int]] = OrderedDict()
+
+
+def _expiry_day() -> int | None:
+    # Items expired by the retention policy leave the lists without a version bump. They all
+    # expire at the end of a UTC day (see retention_attributes), so pages are not reused across days.
+    return int(time.time()) // 86400 if CHAT_RETENTION_DAYS is not None else None
+
+
+def get_cached_list_version(x_user_sub: str, list_type: str, read: Callable[[], int]) -> int:
+    """Return the version of a list kept by this process, read again once older than LIST_VERSION_TTL_SECONDS
+
+    Unchanged lists are then served (or answered with 304) without reading the table.
+
+    Args:
+        x_user_sub: User ID
+        list_type: Type of the list ("chat" or "gallery")
+        read: Function that reads the version from DynamoDB
+    """
+    key = (x_user_sub, list_type)
+
+    with _list_cache_lock:
+        entry = _list_versions.get(key)
+
+    if entry is not None and time.monotonic() - entry[0] < LIST_VERSION_TTL_SECONDS:
+        return entry[1]
+
+    version = read()
+    remember_list_version(x_user_sub, list_type, version)
+
+    # An eventually consistent read can lag behind a version this process wrote
+    return max(version, entry[1]) if entry is not None else version
+
+
+def remember_list_version(x_user_sub: str, list_type: str, version: int) -> None:
+    """Keep the version of a list read from, or written to, the table. Versions only go up."""
+    key = (x_user_sub, list_type)
+
+    with _list_cache_lock:
+        entry = _list_versions.get(key)
+        _list_versions[key] = (time.monotonic(), max(version, entry[1]) if entry is not None else version)
+        _list_versions.move_to_end(key)
+
+        while len(_list_versions) > LIST_CACHE_MAX_ENTRIES:
+            _list_versions.popitem(last=False)
+
+
+def list_etag(x_user_sub: str, list_type: str, version: int, *params) -> str:
+    """Build the ETag of a list page from the list version and the page parameters"""
+    digest = hashlib.sha256(json.dumps([x_user_sub, list_type, version, _expiry_day(), *params], ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check whether the If-None-Match request header matches the ETag"""
+    if if_none_match is None:
+        return False
+
+    candidates = [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def get_list_page(x_user_sub: str, list_type: str, version: int, params: tuple, fetch: Callable[[], dict]) -> dict:
+    """Read-through cache for list pages (chats, gallery items)
+
+    Entries are keyed by the list version, which the write functions in database.py
+    bump, and by the day when a retention policy expires items, so stale pages are
+    never returned and simply age out of the LRU.
+
+    Args:
+        x_user_sub: User ID
+        list_type: Type of the list ("chat" or "gallery")
+        version: Version of the list from get_list_version
+        params: Page parameters (exclusive_start_key, limit)
+        fetch: Function that queries the page from DynamoDB on cache miss
+    """
+    key = (x_user_sub, list_type, version, _expiry_day(), *params)
+
+    with _list_cache_lock:
+        if key in _list_cache:
+            _list_cache.move_to_end(key)
+            return _list_cache[key]
+
+    page = fetch()
+
+    with _list_cache_lock:
+        _list_cache[key] = page
+        _list_cache.move_to_end(key)
+
+        while len(_list_cache) > LIST_CACHE_MAX_ENTRIES:
+            _list_cache.popitem(last=False)
+
+    return page
+
+
+def normalize_tool_input(value):
+    """Normalize tool arguments so that equivalent calls share a cache key"""
+    if isinstance(value, dict):
+        return {k: normalize_tool_input(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, list):
+        return [normalize_tool_input(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def tool_cache_key(tool_name: str, tool_input: dict) -> str:
+    normalized = json.dumps([tool_name, normalize_tool_input(tool_input)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ToolResultCache:
+    """Process-wide LRU cache of tool results, bounded by total size in bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[float, int, list]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> list | None:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires_at, size, content = entry
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._size -= size
+                return None
+
+            self._entries.move_to_end(key)
+            return content
+
+    def put(self, key: str, content: list, ttl: float) -> None:
+        size = len(json.dumps(content, ensure_ascii=False, default=str))
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+
+            self._entries[key] = (time.monotonic() + ttl, size, content)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+
+tool_result_cache = ToolResultCache(TOOL_RESULT_CACHE_MAX_BYTES)
@@ -10,6 +10,150 @@ PARAMETER = json.loads(os.environ["PARAMETER"])
 # Constants
 WORKSPACE_DIR = "/tmp/ws"
 
+# Bedrock retries inside botocore. Throttling is handled by admission control instead of long retry chains.
+BEDROCK_MAX_ATTEMPTS = 3
+
+# Output tokens of chat answers, and thinking budget when the reasoning tool is selected
+MODEL_MAX_TOKENS = 4096
+REASONING_BUDGET_TOKENS = 1024
+
+# Admission control for Bedrock streams (per process, so only with the container workers of serve.py)
+MAX_STREAMS_PER_USER = 2
+MAX_STREAMS_PER_MODEL = 16
+MIN_STREAMS_PER_MODEL = 1
+STREAM_QUEUE_MAX_SIZE = 100
+STREAM_QUEUE_MAX_WAIT_SECONDS = 30
+THROTTLE_DECREASE_COOLDOWN_SECONDS = 5
+# Retry-After of the 503 returned when the queue is full
+STREAM_QUEUE_RETRY_AFTER_SECONDS = 5
+
+# Multi-region routing for Bedrock models (regions per model come from PARAMETER["models"])
+ROUTING_WINDOW_SECONDS = 300
+ROUTING_MIN_SAMPLES = 3
+ROUTING_UNHEALTHY_ERROR_RATE = 0.5
+ROUTING_DEFAULT_TTFT_SECONDS = 3
+ROUTING_HEDGE_DELAY_SECONDS = 10
+
+# Warm AgentCore code interpreter / browser sessions kept per chat
+TOOL_SESSION_IDLE_TTL_SECONDS = 600
+TOOL_SESSION_POOL_MAX_SIZE = 20
+
+# Seconds a process reuses the version of a user's chat or gallery list before reading it again.
+# Writes of the process bump it right away. Writes of other processes show up after at most this long.
+LIST_VERSION_TTL_SECONDS = 5
+
+# Cross-session cache of web search and AWS documentation tool results (TTL in seconds per tool)
+TOOL_RESULT_CACHE_TTL_SECONDS = {
+    "tavily_search": 600,
+    "tavily_extract": 3600,
+    "tavily_crawl": 3600,
+    "tavily_map": 3600,
+    "search_documentation": 86400,
+    "read_documentation": 86400,
+    "recommend": 86400,
+}
+TOOL_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Tool execution policy of the streaming agent
+TOOL_EXECUTION_CONCURRENT = True
+TOOL_TIMEOUT_DEFAULT_SECONDS = 120
+TOOL_TIMEOUT_SECONDS = {
+    "code_interpreter": 300,
+    "browser": 300,
+    "generate_image": 180,
+    "generate_image_with_colors": 180,
+    "upload_file_to_s3_and_retrieve_s3_url": 60,
+}
+# Characters of text/JSON per tool result fed back into the prompt
+TOOL_RESULT_DEFAULT_MAX_CHARS = 20000
+TOOL_RESULT_MAX_CHARS = {
+    "tavily_crawl": 30000,
+    "tavily_extract": 30000,
+    "read_documentation": 30000,
+}
+
+# Models that read attachments from S3 references (s3Location) instead of inline bytes,
+# unless PARAMETER["models"] sets "s3Location" for the model
+S3_LOCATION_MODEL_ID_PATTERNS = ("amazon.nova-",)
+
+# Preprocessing of attachments. Derivatives are stored next to the original S3 object.
+ATTACHMENT_IMAGE_MAX_DIMENSION = 1568
+ATTACHMENT_IMAGE_MAX_BYTES = 1024 * 1024
+ATTACHMENT_IMAGE_JPEG_QUALITY = 85
+ATTACHMENT_PREPROCESS_CONCURRENCY = 4
+ATTACHMENT_DERIVATIVE_CACHE_MAX_ENTRIES = 1024
+
+# Full-text search over the chats of a user
+SEARCH_MAX_TERM_LENGTH = 64
+SEARCH_MAX_TERMS_PER_DOCUMENT = 200
+SEARCH_MAX_QUERY_TERMS = 8
+SEARCH_MAX_POSTINGS_PER_TERM = 1000
+SEARCH_MAX_RESULTS = 20
+SEARCH_TITLE_WEIGHT = 2
+
+# Bulk export of a user's data: message partitions read in parallel, and bytes per streamed chunk
+EXPORT_CONCURRENCY = 4
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Seconds running streams get to finish after SIGTERM before they are stopped (their partial answers are saved).
+# Below the default stop timeout of ECS and Kubernetes (30 seconds).
+STREAM_DRAIN_SECONDS = 25
+
+# Message updates (UpdateItem requests) sent in parallel
+MESSAGE_UPDATE_CONCURRENCY = 8
+
+# Deletion of chats: BatchWriteItem and DeleteObjects requests sent in parallel
+DELETE_CONCURRENCY = 8
+
+# Optional retention policy. Chats, messages, search postings and gallery items expire (DynamoDB TTL)
+# this many days after they are written, and the file bucket expires objects after the same number of days.
+CHAT_RETENTION_DAYS = PARAMETER.get("chatRetentionDays")
+
+# Logging: records go through a bounded queue to a writer thread. Each line of code logs at most
+# LOG_SAMPLE_BURST records per window (warnings and errors beyond that are kept without traceback).
+# The number of records suppressed on each line is logged once per window.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_QUEUE_MAX_SIZE = 10000
+LOG_SAMPLE_BURST = 20
+LOG_SAMPLE_WINDOW_SECONDS = 10
+# Never sampled: uvicorn logs the access line of every request from the same line
+LOG_SAMPLE_EXEMPT_LOGGERS = ("uvicorn.access",)
+LOG_MAX_TRACEBACK_CHARS = 8000
+
+# Opt-in profiling of single requests: requests with the X-Profile header set to PROFILE_TOKEN, and a
+# PROFILE_SAMPLE_RATE fraction of the others. Profiles are collapsed stacks (flamegraph.pl, speedscope)
+# written under PROFILE_S3_PREFIX of the file bucket, or to PROFILE_DIR when set.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_S3_PREFIX = "profiles/"
+PROFILE_INTERVAL_SECONDS = 0.005
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_DEPTH = 128
+
+# Seconds the startup waits for the warm-up (see warm_up). Below the 10 seconds of the Lambda init phase.
+WARMUP_TIMEOUT_SECONDS = 8
+# GET /api/warmup runs the warm-up at most this often per process
+WARMUP_MIN_INTERVAL_SECONDS = 60
+
+# Seconds between checks for a stop request sent to another instance while a stream is running
+STREAM_CANCEL_POLL_SECONDS = 2
+# Seconds a chat deletion waits for the streams of the chat to stop and save their partial answer
+STREAM_STOP_TIMEOUT_SECONDS = 10
+
+# Idempotency of POST /api/streaming, keyed by the assistant message resourceId
+STREAM_CHECKPOINT_SECONDS = 2
+STREAM_LEASE_SECONDS = 30
+# Requests following a stream from another instance renew their registration this often. The text
+# of a running stream is only written while a registration is younger than STREAM_LEASE_SECONDS.
+STREAM_FOLLOWER_RENEW_SECONDS = 10
+STREAM_REPLAY_TTL_SECONDS = 86400
+
+# Response compression (brotli, or gzip for clients without it)
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
 # System prompt for AI agent
 SYSTEM_PROMPT = f"""## Basic Output Policy
 - When structuring text, please output in markdown format. However, there's no need to forcibly create chapters in markdown for simple plain text responses.
@@ -1,16 +1,56 @@
+import functools
 import json
-from datetime import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
 
-import boto3
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
-from config import RESOURCE_INDEX_NAME, TABLE
-from models import MessageWillBeInTable
-from utils import base64_to_str, str_to_base64
+from aws import get_boto_session
+from cache import get_cached_list_version, remember_list_version
+from config import CHAT_RETENTION_DAYS, DELETE_CONCURRENCY, MESSAGE_UPDATE_CONCURRENCY, RESOURCE_INDEX_NAME, SEARCH_MAX_POSTINGS_PER_TERM, STREAM_LEASE_SECONDS, STREAM_REPLAY_TTL_SECONDS, TABLE
+from models import MessageUpdate, MessageWillBeInTable
+from search import message_term_frequencies, term_frequencies
+from utils import base64_to_str, generate_sort_key, str_to_base64
+
+
+@functools.cache
+def _get_dynamodb_resource():
+    return get_boto_session().resource("dynamodb")
+
+
+@functools.cache
+def get_dynamodb_client():
+    """Low-level client, shared by every thread (clients are thread safe, unlike resources)"""
+    return get_boto_session().client("dynamodb")
 
 
 def get_dynamodb_table():
-    return boto3.resource("dynamodb").Table(TABLE)
+    # Table objects are cheap: only the resource (and its connection pool) is shared
+    return _get_dynamodb_resource().Table(TABLE)
+
+
+def retention_attributes() -> dict:
+    """expiresAt of the items covered by the retention policy (nothing when CHAT_RETENTION_DAYS is not set)
+
+    Items expire at the end of a UTC day, so cached list pages only have to change once a day (see cache.py).
+    """
+    if CHAT_RETENTION_DAYS is None:
+        return {}
+
+    return {"expiresAt": (int(time.time()) // 86400 + CHAT_RETENTION_DAYS + 1) * 86400}
+
+
+def is_expired(item: dict) -> bool:
+    # DynamoDB TTL deletes expired items up to a few days later: they are skipped when read
+    return "expiresAt" in item and int(item["expiresAt"]) <= time.time()
+
+
+def not_expired():
+    """Filter expression of the items that are not expired (see is_expired)"""
+    return Attr("expiresAt").not_exists() | Attr("expiresAt").gt(int(time.time()))
 
 
 def find_chat_by_resource_id(resource_id: str) -> dict | None:
@@ -26,7 +66,7 @@ def find_chat_by_resource_id(resource_id: str) -> dict | None:
     else:
         item = items[0]
 
-        if item["dataType"] == "chat":
+        if item["dataType"] == "chat" and not is_expired(item):
             return item
         else:
             return None
@@ -44,6 +84,55 @@ def is_chat_mine(resource_id: str, x_user_sub: str) -> bool:
     return True
 
 
+def get_list_version(x_user_sub: str, list_type: str) -> int:
+    """Get the version of a user's list ("chat" or "gallery"), bumped on every write to the list
+
+    The version is kept in memory for LIST_VERSION_TTL_SECONDS (see get_cached_list_version).
+    """
+
+    def read() -> int:
+        table = get_dynamodb_table()
+        item = table.get_item(
+            Key={
+                "queryId": f"{x_user_sub}$version",
+                "orderBy": list_type,
+            },
+        ).get("Item")
+
+        if item is None:
+            return 0
+
+        return int(item["version"])
+
+    return get_cached_list_version(x_user_sub, list_type, read)
+
+
+def bump_list_version(x_user_sub: str, list_type: str) -> None:
+    """Invalidate the cached pages of a user's list ("chat" or "gallery")"""
+    table = get_dynamodb_table()
+    response = table.update_item(
+        Key={
+            "queryId": f"{x_user_sub}$version",
+            "orderBy": list_type,
+        },
+        UpdateExpression="add #version :one set #userId = :userId, #dataType = :dataType",
+        ExpressionAttributeNames={
+            "#version": "version",
+            "#userId": "userId",
+            "#dataType": "dataType",
+        },
+        ExpressionAttributeValues={
+            ":one": 1,
+            ":userId": x_user_sub,
+            ":dataType": "version",
+        },
+        ReturnValues="UPDATED_NEW",
+    )
+
+    # The pages of this process are invalidated right away, those of the others within LIST_VERSION_TTL_SECONDS
+    remember_list_version(x_user_sub, list_type, int(response["Attributes"]["version"]))
+
+
 def create_chat_in_db(resource_id: str, x_user_sub: str) -> dict:
     item = {
         "queryId": f"{x_user_sub}$chat",
@@ -52,10 +141,12 @@ def create_chat_in_db(resource_id: str, x_user_sub: str) -> dict:
         "userId": x_user_sub,
         "dataType": "chat",
         "title": "",
+        **retention_attributes(),
     }
 
     table = get_dynamodb_table()
     table.put_item(Item=item)
+    bump_list_version(x_user_sub, "chat")
 
     return item
 
@@ -65,6 +156,7 @@ def get_chats_from_db(x_user_sub: str, exclusive_start_key: str | None = None, l
 
     query_params = {
         "KeyConditionExpression": Key("queryId").eq(query_id),
+        "FilterExpression": not_expired(),
         "ScanIndexForward": False,
     }
 
@@ -86,20 +178,29 @@ def get_chats_from_db(x_user_sub: str, exclusive_start_key: str | None = None, l
     }
 
 
-def create_messages_in_db(resource_id: str, x_user_sub: str, messages: list[MessageWillBeInTable]) -> list[dict]:
+def create_messages_in_db(resource_id: str, x_user_sub: str, messages: list[MessageWillBeInTable], index: bool = True) -> list[dict]:
+    """Save messages of a chat
+
+    Args:
+        resource_id: Resource ID of the chat
+        x_user_sub: User ID
+        messages: Messages to save
+        index: Whether to add the messages to the search index now. Otherwise the caller passes them to index_messages_in_db.
+    """
     query_id = f"{resource_id}$message"
-    sort_key_base = int(datetime.now().timestamp())
+    retention = retention_attributes()
     messages_in_table = []
 
-    for idx, m in enumerate(messages):
+    for m in messages:
         messages_in_table.append(
             {
                 "queryId": query_id,
-                "orderBy": f"{sort_key_base + idx}",
+                "orderBy": generate_sort_key(),
                 "resourceId": m.resourceId,
                 "dataType": "message",
                 "userId": x_user_sub,
-                **m.dict(),
+                **m.model_dump(),
+                **retention,
             }
         )
 
@@ -109,34 +210,249 @@ def create_messages_in_db(resource_id: str, x_user_sub: str, messages: list[Mess
         for m in messages_in_table:
             batch.put_item(Item=m)
 
+    if index:
+        index_messages_in_db(resource_id, x_user_sub, messages_in_table)
+
+    try:
+        refresh_chat_expiry_in_db(resource_id)
+    except Exception as e:
+        logging.warning(f"Failed to refresh the expiry of chat {resource_id}: {str(e)}")
+
     return messages_in_table
 
 
-def update_messages_in_db(messages: list[MessageWillBeInTable]) -> list[dict]:
-    messages_updated = []
+def index_messages_in_db(resource_id: str, x_user_sub: str, messages_in_table: list[dict]) -> None:
+    """Add saved messages to the search index of the user (one posting per term, up to 200 per message)"""
+    documents = {m["resourceId"]: message_term_frequencies(m["content"]) for m in messages_in_table}
 
-    for m in messages:
-        messages_updated.append(m.dict())
+    try:
+        put_search_postings_in_db(x_user_sub, resource_id, documents)
+
+        # Indexed after the messages were saved: a deletion in between collected these postings (and
+        # uncounted the documents) before they were written
+        if find_chat_by_resource_id(resource_id) is None:
+            delete_search_postings_in_db(x_user_sub, resource_id, documents, count_documents=False)
+    except Exception as e:
+        # The messages are saved. They are just not found by the search.
+        logging.warning(f"Failed to index messages of chat {resource_id}: {str(e)}")
+
+
+def refresh_chat_expiry_in_db(resource_id: str) -> None:
+    """Push back the expiry of a chat when messages are written to it, so that a chat in use does not expire before them"""
+    retention = retention_attributes()
+
+    if not retention:
+        return
+
+    chat = find_chat_by_resource_id(resource_id)
+
+    # Written at most once a day: expiresAt only changes at the end of a day
+    if chat is None or int(chat.get("expiresAt", 0)) >= retention["expiresAt"]:
+        return
 
     table = get_dynamodb_table()
+    table.update_item(
+        Key={
+            "queryId": chat["queryId"],
+            "orderBy": chat["orderBy"],
+        },
+        UpdateExpression="set #expiresAt = :expiresAt",
+        # Never recreates a deleted chat
+        ConditionExpression="attribute_exists(#queryId)",
+        ExpressionAttributeNames={
+            "#queryId": "queryId",
+            "#expiresAt": "expiresAt",
+        },
+        ExpressionAttributeValues={
+            ":expiresAt": retention["expiresAt"],
+        },
+    )
+    bump_list_version(chat["userId"], "chat")
+
+
+def _update_message(client, resource_id: str, x_user_sub: str, update: MessageUpdate) -> dict:
+    changes = update.model_dump(include=update.model_fields_set - {"orderBy", "version"})
+    names = {"#queryId": "queryId", "#userId": "userId", "#version": "version"}
+    values = {":userId": x_user_sub, ":version": update.version, ":zero": 0, ":one": 1}
+    sets = ["#version = if_not_exists(#version, :zero) + :one"]
+    removes = []
+
+    for field, value in changes.items():
+        if field == "contentBlocks":
+            names["#content"] = "content"
+
+            for i, block in value.items():
+                sets.append(f"#content[{i}] = :block{i}")
+                values[f":block{i}"] = block
+        elif value is None:
+            # Only tools can be null (see MessageUpdate)
+            names[f"#{field}"] = field
+            removes.append(f"#{field}")
+        else:
+            names[f"#{field}"] = field
+            sets.append(f"#{field} = :{field}")
+            values[f":{field}"] = value
+
+    content_changed = "content" in changes or "contentBlocks" in changes
+    condition = "attribute_exists(#queryId) AND #userId = :userId AND " + ("(attribute_not_exists(#version) OR #version = :version)" if update.version == 0 else "#version = :version")
+
+    if "contentBlocks" in changes:
+        # DynamoDB would append the blocks past the end instead
+        condition += " AND size(#content) > :maxIndex"
+        values[":maxIndex"] = max(changes["contentBlocks"])
+
+    try:
+        res = client.update_item(
+            TableName=TABLE,
+            Key={
+                "queryId": f"{resource_id}$message",
+                "orderBy": update.orderBy,
+            },
+            UpdateExpression="set " + ", ".join(sets) + (" remove " + ", ".join(removes) if removes else ""),
+            # Never creates a message, and fails when another editor updated it since the client read it
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            # The old content is needed to update the search index
+            ReturnValues="ALL_OLD" if content_changed else "UPDATED_NEW",
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
 
-    with table.batch_writer() as batch:
-        for m in messages_updated:
-            batch.put_item(Item=m)
+        # Not transformed by the resource layer: attributes are in the DynamoDB JSON format
+        item = e.response.get("Item")
+
+        if item is None or item["userId"]["S"] != x_user_sub:
+            return {"orderBy": update.orderBy, "status": "notFound"}
+
+        version = int(item.get("version", {"N": "0"})["N"])
+
+        if version == update.version:
+            # Up to date: the message has fewer content blocks than the indexes of the update
+            return {"orderBy": update.orderBy, "status": "outOfRange", "version": version}
+
+        return {"orderBy": update.orderBy, "status": "conflict", "version": version}
+
+    if not content_changed:
+        return {"orderBy": update.orderBy, "status": "updated", "version": int(res["Attributes"]["version"])}
+
+    old = res["Attributes"]
+    content = changes.get("content")
+
+    if content is None:
+        content = list(old["content"])
 
-    return messages_updated
+        for i, block in changes["contentBlocks"].items():
+            content[i] = block
 
+    try:
+        reindex_message_in_db(x_user_sub, resource_id, old["resourceId"], message_term_frequencies(old["content"]), message_term_frequencies(content))
+    except Exception as e:
+        logging.warning(f"Failed to index message {old['resourceId']} of chat {resource_id}: {str(e)}")
 
-def get_messages_from_db(resource_id: str) -> list[dict]:
+    return {"orderBy": update.orderBy, "status": "updated", "version": int(old.get("version", 0)) + 1}
+
+
+def update_messages_in_db(resource_id: str, x_user_sub: str, updates: list[MessageUpdate]) -> list[dict]:
+    """Apply partial updates to messages of a chat
+
+    Each update only writes the changed fields with UpdateItem, on condition that the message
+    belongs to the user and still has the version the update is based on. Updates are sent in parallel.
+
+    Args:
+        resource_id: Resource ID of the chat
+        x_user_sub: User ID
+        updates: Changed fields of the messages
+
+    Returns:
+        Result of each update: status "updated" (with the new version), "conflict" (with the current version),
+        "outOfRange" (contentBlocks indexes past the end of the content, with the current version) or "notFound"
+    """
+    # The client of a resource is thread safe and still takes Python types
+    client = get_dynamodb_table().meta.client
+
+    with ThreadPoolExecutor(max_workers=MESSAGE_UPDATE_CONCURRENCY) as executor:
+        results = list(executor.map(lambda update: _update_message(client, resource_id, x_user_sub, update), updates))
+
+    if any(result["status"] == "updated" for result in results):
+        try:
+            refresh_chat_expiry_in_db(resource_id)
+        except Exception as e:
+            logging.warning(f"Failed to refresh the expiry of chat {resource_id}: {str(e)}")
+
+    return results
+
+
+def get_messages_from_db(resource_id: str, since: str | None = None) -> list[dict]:
+    """Get messages of a chat in ascending order
+
+    Args:
+        resource_id: Resource ID of the chat
+        since: orderBy of the last message the client already has. Only newer messages are returned when specified.
+    """
     query_id = f"{resource_id}$message"
+    key_condition = Key("queryId").eq(query_id)
+
+    if since is not None:
+        key_condition = key_condition & Key("orderBy").gt(since)
+
     table = get_dynamodb_table()
     items = table.query(
-        KeyConditionExpression=Key("queryId").eq(query_id),
+        KeyConditionExpression=key_condition,
     )["Items"]
 
     return items
 
 
+def get_partition_page_from_db(query_id: str, exclusive_start_key: dict | None = None) -> tuple[list[dict], dict | None]:
+    """Read one page (up to 1 MB) of a partition in ascending order
+
+    Returns the items and the key to pass to read the next page (None after the last page).
+    """
+    query_params = {
+        "KeyConditionExpression": Key("queryId").eq(query_id),
+    }
+
+    if exclusive_start_key is not None:
+        query_params["ExclusiveStartKey"] = exclusive_start_key
+
+    table = get_dynamodb_table()
+    res = table.query(**query_params)
+
+    return res["Items"], res.get("LastEvaluatedKey")
+
+
+def _batch_delete(client, keys: list[dict]) -> None:
+    request_items = {TABLE: [{"DeleteRequest": {"Key": {"queryId": {"S": k["queryId"]}, "orderBy": {"S": k["orderBy"]}}}} for k in keys]}
+
+    for attempt in range(8):
+        request_items = client.batch_write_item(RequestItems=request_items).get("UnprocessedItems")
+
+        if not request_items:
+            return
+
+        # Throttled: retry the unprocessed items with exponential backoff
+        time.sleep(min(0.05 * 2**attempt, 2))
+
+    raise RuntimeError(f"{len(request_items[TABLE])} items could not be deleted")
+
+
+def delete_items_in_db(keys: list[dict]) -> None:
+    """Delete items by key (queryId, orderBy) with BatchWriteItem requests of 25 items sent in parallel"""
+    # A batch with the same key twice is rejected (e.g. a term in the title and a message of the same posting key)
+    keys = list({(k["queryId"], k["orderBy"]): k for k in keys}.values())
+
+    if not keys:
+        return
+
+    client = get_dynamodb_client()
+
+    with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        list(executor.map(lambda i: _batch_delete(client, keys[i : i + 25]), range(0, len(keys), 25)))
+
+
 def update_chat_title(chat: dict, title: str) -> None:
     table = get_dynamodb_table()
     table.update_item(
@@ -152,6 +468,382 @@ def update_chat_title(chat: dict, title: str) -> None:
             ":title": title,
         },
     )
+    bump_list_version(chat["userId"], "chat")
+
+    try:
+        if chat.get("title"):
+            delete_search_postings_in_db(chat["userId"], chat["resourceId"], {None: term_frequencies(chat["title"])})
+        put_search_postings_in_db(chat["userId"], chat["resourceId"], {None: term_frequencies(title)})
+    except Exception as e:
+        logging.warning(f"Failed to index title of chat {chat['resourceId']}: {str(e)}")
+
+
+def search_posting_key(x_user_sub: str, term: str, chat_id: str, message_id: str | None) -> dict:
+    # Postings of a chat title have no message ID
+    return {
+        "queryId": f"{x_user_sub}$term#{term}",
+        "orderBy": f"{chat_id}#{message_id or ''}",
+    }
+
+
+def update_search_document_count(x_user_sub: str, delta: int) -> None:
+    if delta == 0:
+        return
+
+    table = get_dynamodb_table()
+    table.update_item(
+        Key={
+            "queryId": f"{x_user_sub}$search",
+            "orderBy": "documents",
+        },
+        UpdateExpression="add #documents :delta set #userId = :userId, #dataType = :dataType",
+        ExpressionAttributeNames={
+            "#documents": "documents",
+            "#userId": "userId",
+            "#dataType": "dataType",
+        },
+        ExpressionAttributeValues={
+            ":delta": delta,
+            ":userId": x_user_sub,
+            ":dataType": "search",
+        },
+    )
+
+
+def put_search_postings_in_db(x_user_sub: str, chat_id: str, documents: dict[str | None, dict[str, int]], count_documents: bool = True) -> None:
+    """Add documents of a chat to the search index of the user
+
+    The index is an inverted index: one posting item per term and document, in the partition of the term.
+
+    Args:
+        x_user_sub: User ID
+        chat_id: Resource ID of the chat
+        documents: Message resource ID (None for the chat title) -> term frequencies
+        count_documents: Whether the messages are new documents of the index (False when only their terms change)
+    """
+    retention = retention_attributes()
+    table = get_dynamodb_table()
+
+    with table.batch_writer() as batch:
+        for message_id, terms in documents.items():
+            for term, tf in terms.items():
+                # No dataType, so that postings (most of the index writes) are not copied to DataTypeIndex
+                item = {
+                    **search_posting_key(x_user_sub, term, chat_id, message_id),
+                    "userId": x_user_sub,
+                    "chatId": chat_id,
+                    "tf": tf,
+                    **retention,
+                }
+
+                if message_id is not None:
+                    item["messageId"] = message_id
+
+                batch.put_item(Item=item)
+
+    if count_documents:
+        update_search_document_count(x_user_sub, sum(1 for message_id, terms in documents.items() if message_id is not None and terms))
+
+
+def delete_search_postings_in_db(x_user_sub: str, chat_id: str, documents: dict[str | None, dict[str, int]], count_documents: bool = True) -> None:
+    """Remove documents of a chat from the search index of the user. Takes the same documents as put_search_postings_in_db."""
+    table = get_dynamodb_table()
+
+    with table.batch_writer() as batch:
+        for message_id, terms in documents.items():
+            for term in terms:
+                batch.delete_item(Key=search_posting_key(x_user_sub, term, chat_id, message_id))
+
+    if count_documents:
+        update_search_document_count(x_user_sub, -sum(1 for message_id, terms in documents.items() if message_id is not None and terms))
+
+
+def reindex_message_in_db(x_user_sub: str, chat_id: str, message_id: str, old_terms: dict[str, int], new_terms: dict[str, int]) -> None:
+    """Update the postings of an edited message. Only the terms that changed are written."""
+    delete_search_postings_in_db(x_user_sub, chat_id, {message_id: {t: tf for t, tf in old_terms.items() if t not in new_terms}}, count_documents=False)
+    put_search_postings_in_db(x_user_sub, chat_id, {message_id: {t: tf for t, tf in new_terms.items() if old_terms.get(t) != tf}}, count_documents=False)
+    update_search_document_count(x_user_sub, bool(new_terms) - bool(old_terms))
+
+
+def get_search_postings_from_db(x_user_sub: str, term: str, limit: int = SEARCH_MAX_POSTINGS_PER_TERM) -> list[dict]:
+    """Get the postings of a term, at most limit of them"""
+    query_params = {
+        "KeyConditionExpression": Key("queryId").eq(f"{x_user_sub}$term#{term}"),
+        "ProjectionExpression": "orderBy, chatId, messageId, tf",
+    }
+
+    table = get_dynamodb_table()
+    items = []
+
+    while len(items) < limit:
+        res = table.query(**query_params, Limit=limit - len(items))
+        items.extend(res["Items"])
+
+        if "LastEvaluatedKey" not in res:
+            break
+
+        query_params["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    return items
+
+
+def get_search_document_count_from_db(x_user_sub: str) -> int:
+    table = get_dynamodb_table()
+    item = table.get_item(
+        Key={
+            "queryId": f"{x_user_sub}$search",
+            "orderBy": "documents",
+        },
+    ).get("Item")
+
+    if item is None:
+        return 0
+
+    return int(item["documents"])
+
+
+def create_stream_cancel_request_in_db(resource_id: str, assistant_message_id: str, x_user_sub: str) -> None:
+    """Ask the process serving a stream to stop it (the stream may run on another Lambda instance)
+
+    Args:
+        resource_id: Resource ID of the chat
+        assistant_message_id: Resource ID of the assistant message being generated
+        x_user_sub: User ID
+    """
+    table = get_dynamodb_table()
+    table.put_item(
+        Item={
+            "queryId": f"{resource_id}$cancel",
+            "orderBy": assistant_message_id,
+            "dataType": "cancel",
+            "userId": x_user_sub,
+            "requestedAt": datetime.now().isoformat(),
+            "expiresAt": int(time.time()) + STREAM_REPLAY_TTL_SECONDS,
+        }
+    )
+
+
+def find_stream_cancel_request_in_db(resource_id: str, assistant_message_id: str) -> bool:
+    table = get_dynamodb_table()
+    item = table.get_item(
+        Key={
+            "queryId": f"{resource_id}$cancel",
+            "orderBy": assistant_message_id,
+        },
+    ).get("Item")
+
+    return item is not None
+
+
+def delete_stream_cancel_request_in_db(resource_id: str, assistant_message_id: str) -> None:
+    table = get_dynamodb_table()
+    table.delete_item(
+        Key={
+            "queryId": f"{resource_id}$cancel",
+            "orderBy": assistant_message_id,
+        },
+    )
+
+
+def claim_stream_in_db(resource_id: str, assistant_message_id: str, x_user_sub: str) -> bool:
+    """Record that this instance generates the assistant message. Returns False when another request already does (or did).
+
+    A running record whose owner stopped renewing it for STREAM_LEASE_SECONDS can be claimed again.
+
+    Args:
+        resource_id: Resource ID of the chat
+        assistant_message_id: Resource ID of the assistant message (idempotency key)
+        x_user_sub: User ID
+    """
+    now = int(time.time())
+    table = get_dynamodb_table()
+
+    try:
+        table.put_item(
+            Item={
+                "queryId": f"{resource_id}$stream",
+                "orderBy": assistant_message_id,
+                "dataType": "stream",
+                "userId": x_user_sub,
+                "status": "running",
+                "text": "",
+                "heartbeatAt": now,
+                "expiresAt": now + STREAM_REPLAY_TTL_SECONDS,
+            },
+            ConditionExpression="attribute_not_exists(queryId) OR (#status = :running AND #heartbeatAt < :expired)",
+            ExpressionAttributeNames={
+                "#status": "status",
+                "#heartbeatAt": "heartbeatAt",
+            },
+            ExpressionAttributeValues={
+                ":running": "running",
+                ":expired": now - STREAM_LEASE_SECONDS,
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+    return True
+
+
+def get_stream_from_db(resource_id: str, assistant_message_id: str) -> dict | None:
+    table = get_dynamodb_table()
+    return table.get_item(
+        Key={
+            "queryId": f"{resource_id}$stream",
+            "orderBy": assistant_message_id,
+        },
+        ConsistentRead=True,
+    ).get("Item")
+
+
+def get_streams_from_db(resource_id: str) -> list[dict]:
+    """Get the stream records of a chat, without their text"""
+    table = get_dynamodb_table()
+    return table.query(
+        KeyConditionExpression=Key("queryId").eq(f"{resource_id}$stream"),
+        ProjectionExpression="#orderBy, #status, #heartbeatAt",
+        ExpressionAttributeNames={
+            "#orderBy": "orderBy",
+            "#status": "status",
+            "#heartbeatAt": "heartbeatAt",
+        },
+        ConsistentRead=True,
+    )["Items"]
+
+
+def renew_stream_lease_in_db(resource_id: str, assistant_message_id: str) -> int:
+    """Renew the lease of a running stream without rewriting its text
+
+    Returns the last time a request of another instance registered to follow the stream (0 when none did).
+    """
+    table = get_dynamodb_table()
+    res = table.update_item(
+        Key={
+            "queryId": f"{resource_id}$stream",
+            "orderBy": assistant_message_id,
+        },
+        UpdateExpression="set #heartbeatAt = :now",
+        ExpressionAttributeNames={
+            "#heartbeatAt": "heartbeatAt",
+        },
+        ExpressionAttributeValues={
+            ":now": int(time.time()),
+        },
+        ReturnValues="ALL_NEW",
+    )
+    return int(res["Attributes"].get("followedAt", 0))
+
+
+def follow_stream_in_db(resource_id: str, assistant_message_id: str) -> None:
+    """Register a request following the stream, so that the instance generating it writes its text"""
+    table = get_dynamodb_table()
+    table.update_item(
+        Key={
+            "queryId": f"{resource_id}$stream",
+            "orderBy": assistant_message_id,
+        },
+        UpdateExpression="set #followedAt = :now",
+        ConditionExpression="attribute_exists(queryId)",
+        ExpressionAttributeNames={
+            "#followedAt": "followedAt",
+        },
+        ExpressionAttributeValues={
+            ":now": int(time.time()),
+        },
+    )
+
+
+def update_stream_in_db(resource_id: str, assistant_message_id: str, text: str, status: str = "running") -> None:
+    """Save the text generated so far for the requests following the stream and renew the lease (status "running"), or the final text (status "done")"""
+    table = get_dynamodb_table()
+    table.update_item(
+        Key={
+            "queryId": f"{resource_id}$stream",
+            "orderBy": assistant_message_id,
+        },
+        UpdateExpression="set #text = :text, #status = :status, #heartbeatAt = :now",
+        ExpressionAttributeNames={
+            "#text": "text",
+            "#status": "status",
+            "#heartbeatAt": "heartbeatAt",
+        },
+        ExpressionAttributeValues={
+            ":text": text,
+            ":status": status,
+            ":now": int(time.time()),
+        },
+    )
+
+
+def delete_stream_in_db(resource_id: str, assistant_message_id: str) -> None:
+    table = get_dynamodb_table()
+    table.delete_item(
+        Key={
+            "queryId": f"{resource_id}$stream",
+            "orderBy": assistant_message_id,
+        },
+    )
+
+
+def add_usage_in_db(x_user_sub: str, model_id: str, model_region: str, counters: dict) -> None:
+    """Add the usage of an answer to the daily counters of the user, model and region
+
+    Args:
+        x_user_sub: User ID
+        model_id: Bedrock model ID
+        model_region: Region the model was called in
+        counters: Values to add (inputTokens, outputTokens, latencyMs, ...)
+    """
+    day = datetime.now(UTC).strftime("%Y-%m-%d")
+    names = {f"#{k}": k for k in counters}
+    values = {f":{k}": v for k, v in counters.items()}
+
+    table = get_dynamodb_table()
+    table.update_item(
+        Key={
+            "queryId": f"{x_user_sub}$usage",
+            "orderBy": f"{day}#{model_id}#{model_region}",
+        },
+        UpdateExpression="add " + ", ".join(f"#{k} :{k}" for k in counters) + " set #userId = :userId, #dataType = :dataType, #modelId = :modelId, #modelRegion = :modelRegion, #day = :day",
+        ExpressionAttributeNames={
+            **names,
+            "#userId": "userId",
+            "#dataType": "dataType",
+            "#modelId": "modelId",
+            "#modelRegion": "modelRegion",
+            "#day": "day",
+        },
+        ExpressionAttributeValues={
+            **values,
+            ":userId": x_user_sub,
+            ":dataType": "usage",
+            ":modelId": model_id,
+            ":modelRegion": model_region,
+            ":day": day,
+        },
+    )
+
+
+def get_usage_from_db(x_user_sub: str, start_day: str, end_day: str) -> list[dict]:
+    """Get the daily usage counters of a user between two days (YYYY-MM-DD, inclusive)"""
+    query_params = {
+        "KeyConditionExpression": Key("queryId").eq(f"{x_user_sub}$usage") & Key("orderBy").between(f"{start_day}#", f"{end_day}#\uffff"),
+    }
+
+    table = get_dynamodb_table()
+    items = []
+
+    while True:
+        res = table.query(**query_params)
+        items.extend(res["Items"])
+
+        if "LastEvaluatedKey" not in res:
+            return items
+
+        query_params["ExclusiveStartKey"] = res["LastEvaluatedKey"]
 
 
 def create_gallery_item_in_db(bucket: str, key: str, bucket_region: str, filename: str, x_user_sub: str) -> dict:
@@ -172,10 +864,12 @@ def create_gallery_item_in_db(bucket: str, key: str, bucket_region: str, filenam
         "bucketRegion": bucket_region,
         "filename": filename,
         "uploadedAt": datetime.now().isoformat(),
+        **retention_attributes(),
     }
 
     table = get_dynamodb_table()
     table.put_item(Item=item)
+    bump_list_version(x_user_sub, "gallery")
 
     return item
 
@@ -186,7 +880,18 @@ def get_gallery_items_from_db(x_user_sub: str, exclusive_start_key: str | None =
 
     query_params = {
         "KeyConditionExpression": Key("queryId").eq(query_id),
+        "FilterExpression": not_expired(),
         "ScanIndexForward": False,  # Newest first
+        # Only the attributes of GalleryItem
+        "ProjectionExpression": "#bucket, #key, #bucketRegion, #filename, #uploadedAt, #userId",
+        "ExpressionAttributeNames": {
+            "#bucket": "bucket",
+            "#key": "key",
+            "#bucketRegion": "bucketRegion",
+            "#filename": "filename",
+            "#uploadedAt": "uploadedAt",
+            "#userId": "userId",
+        },
     }
 
     if exclusive_start_key is not None:
@@ -0,0 +1,246 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import UTC, datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import LOG_LEVEL, LOG_MAX_TRACEBACK_CHARS, LOG_QUEUE_MAX_SIZE, LOG_SAMPLE_BURST, LOG_SAMPLE_EXEMPT_LOGGERS, LOG_SAMPLE_WINDOW_SECONDS
+
+# Added to every record logged while handling a request (also from its tasks and threads)
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+chat_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("chat_id", default=None)
+
+# X-Request-Id values kept as the request ID. Others are replaced: the header is logged with every record.
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9-]{1,64}")
+
+
+def set_log_chat_id(chat_id: str) -> None:
+    chat_id_var.set(chat_id)
+
+
+class ContextFilter(logging.Filter):
+    """Attach the request and chat IDs of the current context. Runs in the thread that logs."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.chat_id = chat_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limit records logged from the same line
+
+    Each line logs at most LOG_SAMPLE_BURST records per window. Beyond that, records below
+    WARNING are dropped, and warnings and errors are kept without their traceback. The next
+    record of the line, or the report of take_suppressed, tells how many were suppressed.
+    Records of LOG_SAMPLE_EXEMPT_LOGGERS are never sampled.
+    """
+
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, window_seconds: float = LOG_SAMPLE_WINDOW_SECONDS, exempt_loggers: tuple[str, ...] = LOG_SAMPLE_EXEMPT_LOGGERS):
+        super().__init__()
+        self.burst = burst
+        self.window_seconds = window_seconds
+        self.exempt_loggers = exempt_loggers
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, records in the window, records suppressed, logger name, highest level suppressed]
+        self._sites: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.name in self.exempt_loggers or getattr(record, "sampling_report", False):
+            return True
+
+        now = time.monotonic()
+
+        with self._lock:
+            site = self._sites.setdefault((record.pathname, record.lineno), [now, 0, 0, record.name, logging.NOTSET])
+
+            if now - site[0] >= self.window_seconds:
+                site[0], site[1] = now, 0
+
+            site[1] += 1
+
+            if site[1] <= self.burst:
+                if site[2]:
+                    record.suppressed = site[2]
+                    site[2] = 0
+                    site[4] = logging.NOTSET
+                return True
+
+            site[2] += 1
+            site[4] = max(site[4], record.levelno)
+
+        if record.levelno < logging.WARNING:
+            return False
+
+        if record.exc_info:
+            record.exc_summary = "".join(traceback.format_exception_only(record.exc_info[1])).strip()
+            record.exc_info = None
+
+        return True
+
+    def take_suppressed(self) -> list[logging.LogRecord]:
+        """Records reporting how many records each line suppressed since it last reported"""
+        now = time.monotonic()
+        records = []
+
+        with self._lock:
+            for (pathname, lineno), site in list(self._sites.items()):
+                if site[2]:
+                    record = logging.LogRecord(site[3], site[4], pathname, lineno, f"{site[2]} records suppressed ({os.path.basename(pathname)}:{lineno})", None, None)
+                    record.suppressed = site[2]
+                    record.sampling_report = True
+                    records.append(record)
+                    site[2] = 0
+                    site[4] = logging.NOTSET
+                elif now - site[0] >= 2 * self.window_seconds:
+                    # Quiet line: forget it
+                    del self._sites[(pathname, lineno)]
+
+        return records
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for CloudWatch Logs Insights"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for attribute, key in (("request_id", "requestId"), ("chat_id", "chatId"), ("suppressed", "suppressed"), ("dropped", "dropped"), ("exc_summary", "exception")):
+            value = getattr(record, attribute, None)
+            if value is not None:
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)[-LOG_MAX_TRACEBACK_CHARS:]
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped (and counted) when the queue is full
+
+    Formatting, including tracebacks, is left to the listener thread. report_dropped logs how many were dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def report_dropped(self) -> None:
+        """Log a warning with the number of records dropped since the last report
+
+        While the queue is still full, the count is kept for the next report.
+        """
+        with self._dropped_lock:
+            if not self.dropped:
+                return
+
+            record = logging.LogRecord(__name__, logging.WARNING, __file__, 0, f"{self.dropped} records dropped (queue full)", None, None)
+            record.dropped = self.dropped
+
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                return
+
+            self.dropped = 0
+
+
+def setup_logging() -> QueueListener:
+    """Send the records of every logger through a queue to a thread writing JSON lines to stdout"""
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX_SIZE)
+
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    sampling_filter = SamplingFilter()
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(sampling_filter)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    for name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+
+    logging.getLogger("strands").propagate = True
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Write the records still in the queue on exit
+    atexit.register(listener.stop)
+
+    def report_suppressed():
+        # Lines that went quiet after a burst would never report their suppressed records otherwise
+        while True:
+            time.sleep(sampling_filter.window_seconds)
+
+            for record in sampling_filter.take_suppressed():
+                queue_handler.handle(record)
+
+            queue_handler.report_dropped()
+
+    threading.Thread(target=report_suppressed, name="log-sampling-report", daemon=True).start()
+
+    return listener
+
+
+class RequestContextMiddleware:
+    """Set the request ID logged with every record of a request (a valid X-Request-Id header, or a new ID)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id")
+
+        if request_id is None or not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+
+        request_id_token = request_id_var.set(request_id)
+        chat_id_token = chat_id_var.set(None)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_id_var.reset(request_id_token)
+            chat_id_var.reset(chat_id_token)
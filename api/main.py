@@ -1,38 +1,75 @@
+import asyncio
 import logging
-import sys
+import signal
+import threading
+from contextlib import asynccontextmanager
+from typing import Annotated
 
 import uvicorn
-from fastapi import FastAPI, Request, Response, status
+from fastapi import FastAPI, Header, Request, Response, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
-from config import PARAMETER
-from routers import chat, file, gallery, streaming
+from compression import CompressionMiddleware
+from config import PARAMETER, WARMUP_TIMEOUT_SECONDS
+from logs import RequestContextMiddleware, setup_logging
+from profiling import ProfilingMiddleware
+from routers import chat, export, file, gallery, streaming, usage
+from services.stream_registry_service import begin_drain, drain_streams
+from services.streaming_service import wait_for_search_indexing
+from services.tool_session_service import close_all_tool_sessions
+from services.warmup_service import warm_up_if_due
 
+setup_logging()
 
-def setup_logging():
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s", handlers=[logging.StreamHandler(stream=sys.stdout)])
 
-    logging.getLogger("uvicorn").handlers = []
-    logging.getLogger("uvicorn.access").handlers = []
-    logging.getLogger("uvicorn.error").handlers = []
-    logging.getLogger("uvicorn").propagate = True
-    logging.getLogger("uvicorn.access").propagate = True
-    logging.getLogger("uvicorn.error").propagate = True
-    logging.getLogger("strands").propagate = True
+def install_drain_handler():
+    """Stop accepting new streams as soon as SIGTERM is received, then let uvicorn shut down as usual"""
+    if threading.current_thread() is not threading.main_thread():
+        # Signal handlers can only be set from the main thread (e.g. not under TestClient)
+        return
 
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    install_drain_handler()
+    # On Lambda this runs in the init phase, before the first request
+    try:
+        await asyncio.wait_for(asyncio.to_thread(warm_up_if_due), WARMUP_TIMEOUT_SECONDS)
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {str(e)}")
+    yield
+    # Let the running streams finish (or stop and save them). They clean up their workspace and MCP clients.
+    await drain_streams()
+    # Then the search postings of the answers they saved
+    await wait_for_search_indexing()
+    # Stop the AgentCore sessions kept warm for chats
+    await close_all_tool_sessions()
 
-setup_logging()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(CompressionMiddleware)
+# Outside of the compression, so that the profile covers it
+app.add_middleware(ProfilingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so that every record of a request has its ID
+app.add_middleware(RequestContextMiddleware)
 
 
 @app.exception_handler(RequestValidationError)
@@ -47,6 +84,21 @@ async def healthcheck_api():
     return Response(status_code=status.HTTP_200_OK)
 
 
+@app.get("/api/warmup")
+async def warmup_api(x_user_sub: Annotated[str | None, Header()] = None):
+    """Warm-up ping of a signed-in client, e.g. before a burst of traffic. Warms up at most every WARMUP_MIN_INTERVAL_SECONDS."""
+    if x_user_sub is None:
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    try:
+        await asyncio.to_thread(warm_up_if_due)
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {str(e)}")
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response(status_code=status.HTTP_200_OK)
+
+
 @app.get("/api/parameter")
 async def parameter():
     return {
@@ -57,9 +109,11 @@ async def parameter():
 
 # Include routers
 app.include_router(chat.router)
+app.include_router(export.router)
 app.include_router(file.router)
 app.include_router(gallery.router)
 app.include_router(streaming.router)
+app.include_router(usage.router)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Annotated
+
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
 
 
 class InTable(BaseModel):
@@ -16,13 +18,27 @@ class MessageNotInTable(BaseModel):
 
 
 class MessageInTable(MessageNotInTable, InTable):
-    pass
+    # Token usage and timing of assistant messages (see AssistantMessageWillBeInTable)
+    usage: dict[str, int | str] | None = None
+    # Incremented by every update. Messages never updated have no version (0).
+    version: int = 0
+
+
+# Validates a whole list of items in one pass. Faster than one model at a time, and even than model_construct
+# without validation, which runs in Python (see benchmarks/serialization.py).
+MessageInTableList = TypeAdapter(list[MessageInTable])
 
 
 class MessageWillBeInTable(MessageNotInTable):
     resourceId: str
 
 
+class AssistantMessageWillBeInTable(MessageWillBeInTable):
+    """Answer saved at the end of a stream. Usage is set by the server only: messages sent by clients cannot carry it."""
+
+    usage: dict[str, int | str] | None = None
+
+
 class S3File(BaseModel):
     key: str
 
@@ -35,8 +51,34 @@ class CreateMessages(BaseModel):
     messages: list[MessageWillBeInTable]
 
 
+class MessageUpdate(BaseModel):
+    """Changed fields of a message. Fields that are not sent are left as they are. Only tools can be removed (null)."""
+
+    orderBy: str
+    # Version of the message the change is based on (0 for messages never updated)
+    version: int = Field(ge=0)
+    role: str | None = None
+    content: list[dict[str, str]] | None = None
+    # Replaces single blocks of the content by index, for small edits to long messages. Indexes must exist.
+    contentBlocks: dict[Annotated[int, Field(ge=0)], dict[str, str]] | None = None
+    tools: list[str] | None = None
+
+    @model_validator(mode="after")
+    def check_content(self):
+        for field in ("role", "content", "contentBlocks"):
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"{field} cannot be null")
+        if self.content is not None and self.contentBlocks is not None:
+            raise ValueError("content and contentBlocks cannot be updated together")
+        return self
+
+
 class UpdateMessages(BaseModel):
-    messages: list[MessageWillBeInTable]
+    messages: list[MessageUpdate] = Field(min_length=1, max_length=100)
+
+
+class DeleteChats(BaseModel):
+    resourceIds: list[str] = Field(min_length=1, max_length=100)
 
 
 class CreateTitle(BaseModel):
@@ -51,6 +93,10 @@ class StreamingRequest(BaseModel):
     assistantMessage: MessageWillBeInTable
 
 
+class CancelStreamingRequest(BaseModel):
+    assistantMessageId: str
+
+
 class ToolSelectionRequest(BaseModel):
     prompt: str
 
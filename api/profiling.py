@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import UTC, datetime
+from types import FrameType
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import BUCKET, PROFILE_DIR, PROFILE_INTERVAL_SECONDS, PROFILE_MAX_DEPTH, PROFILE_MAX_SECONDS, PROFILE_S3_PREFIX, PROFILE_SAMPLE_RATE, PROFILE_TOKEN
+from s3 import get_s3_client
+
+# ID of the profile a request belongs to. Tasks created by the request (e.g. stream_task) inherit it.
+profile_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("profile_id", default=None)
+
+# Frames of threads waiting for work: not part of any request
+IDLE_FRAMES = (
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+)
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    # Semicolons separate the frames of a collapsed stack
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _is_idle(frame: FrameType) -> bool:
+    filename = frame.f_code.co_filename
+    return any(filename.endswith(suffix) and frame.f_code.co_name == name for suffix, name in IDLE_FRAMES)
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler of one request, recording collapsed stacks
+
+    A thread reads the stacks of the other threads every PROFILE_INTERVAL_SECONDS. On the event
+    loop thread, only the tasks of the request are sampled. Other threads are sampled while they
+    are not idle, so with concurrent requests, blocking calls of the others (asyncio.to_thread)
+    show up too.
+    """
+
+    def __init__(self, profile_id: str, loop: asyncio.AbstractEventLoop):
+        self.profile_id = profile_id
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.samples: Counter[str] = Counter()
+        self.started_at = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{profile_id}", daemon=True)
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _in_request(self) -> bool:
+        task = asyncio.current_task(self.loop)
+        return task is not None and task.get_context().get(profile_id_var) == self.profile_id
+
+    def _sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self._thread.ident or _is_idle(frame):
+                continue
+            if thread_id == self.loop_thread_id and not self._in_request():
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+
+            stack.append(names.get(thread_id, str(thread_id)).replace(";", ","))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(PROFILE_INTERVAL_SECONDS):
+            if time.monotonic() - self.started_at > PROFILE_MAX_SECONDS:
+                logging.warning(f"Profile {self.profile_id} stopped after {PROFILE_MAX_SECONDS} seconds")
+                return
+
+            self._sample()
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed stack format of flamegraph.pl (also read by speedscope)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _profile_location(profile_id: str) -> str:
+    name = f"{datetime.now(UTC):%Y-%m-%d}/{profile_id}.folded"
+
+    if PROFILE_DIR:
+        return os.path.join(PROFILE_DIR, name)
+
+    return f"s3://{BUCKET}/{PROFILE_S3_PREFIX}{name}"
+
+
+def save_profile(profiler: SamplingProfiler, location: str) -> None:
+    body = profiler.collapsed().encode("utf-8")
+
+    if location.startswith("s3://"):
+        key = location.removeprefix(f"s3://{BUCKET}/")
+        get_s3_client().put_object(Bucket=BUCKET, Key=key, Body=body, ContentType="text/plain; charset=utf-8")
+    else:
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        with open(location, "wb") as f:
+            f.write(body)
+
+    logging.info(f"Saved profile of {sum(profiler.samples.values())} samples ({time.monotonic() - profiler.started_at:.1f} seconds) to {location}")
+
+
+def should_profile(headers: Headers) -> bool:
+    """Profile requests with the X-Profile header set to PROFILE_TOKEN, and a PROFILE_SAMPLE_RATE fraction of the others"""
+    token = headers.get("x-profile")
+
+    if token and PROFILE_TOKEN and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+        return True
+
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    """Profile a request until its response is complete (the end of the stream for streaming responses)
+
+    The location of the profile is returned in the X-Profile-Location response header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not should_profile(Headers(scope=scope)):
+            await self.app(scope, receive, send)
+            return
+
+        # Never named after the request: the profile is written to a path (or key) built from its ID.
+        # The records logged while saving it carry the request ID.
+        profile_id = os.urandom(16).hex()
+        location = _profile_location(profile_id)
+
+        async def send_with_location(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Profile-Location"] = location
+            await send(message)
+
+        token = profile_id_var.set(profile_id)
+        profiler = SamplingProfiler(profile_id, asyncio.get_running_loop())
+        profiler.start()
+
+        try:
+            await self.app(scope, receive, send_with_location)
+        finally:
+            profile_id_var.reset(token)
+            await asyncio.to_thread(profiler.stop)
+
+            try:
+                await asyncio.to_thread(save_profile, profiler, location)
+            except Exception as e:
+                logging.warning(f"Failed to save profile {profile_id}: {str(e)}")
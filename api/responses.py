@@ -0,0 +1,29 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(value: Any) -> Any:
+    # Numbers read from DynamoDB are Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response for items read from our own table
+
+    Return it directly from a route (instead of a dict) to skip FastAPI's jsonable_encoder,
+    which walks every value of the items again before encoding.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
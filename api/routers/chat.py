@@ -1,19 +1,30 @@
+import asyncio
 from typing import Annotated
 
-from fastapi import APIRouter, Header, Response, status
+from fastapi import APIRouter, Header, Query, Response, status
 
+from cache import LIST_CACHE_CONTROL, etag_matches, get_list_page, list_etag
+from config import SEARCH_MAX_RESULTS
 from database import (
     create_chat_in_db,
     create_messages_in_db,
     find_chat_by_resource_id,
     get_chats_from_db,
+    get_list_version,
     get_messages_from_db,
+    get_search_document_count_from_db,
+    get_search_postings_from_db,
     is_chat_mine,
     update_messages_in_db,
 )
-from models import CreateChat, CreateMessages, CreateTitle, ToolSelectionRequest, ToolSelectionResponse, UpdateMessages
+from models import CreateChat, CreateMessages, CreateTitle, DeleteChats, ToolSelectionRequest, ToolSelectionResponse, UpdateMessages
+from responses import FastJSONResponse
+from search import query_terms, rank_search_hits
 from services.chat_service import generate_chat_title
+from services.deletion_service import delete_chats
+from services.stream_registry_service import stop_chat_streams
 from services.tool_selection_service import select_tools_for_prompt
+from services.tool_session_service import close_tool_sessions
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
@@ -27,11 +38,42 @@ def create_chat(request: CreateChat, x_user_sub: Annotated[str | None, Header()]
 @router.get("")
 def get_chats(
     x_user_sub: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
     exclusive_start_key: str | None = None,
     limit: int | None = None,
 ):
-    result = get_chats_from_db(x_user_sub, exclusive_start_key, limit)
-    return result
+    version = get_list_version(x_user_sub, "chat")
+    etag = list_etag(x_user_sub, "chat", version, exclusive_start_key, limit)
+    headers = {"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    result = get_list_page(x_user_sub, "chat", version, (exclusive_start_key, limit), lambda: get_chats_from_db(x_user_sub, exclusive_start_key, limit))
+    return FastJSONResponse(result, headers=headers)
+
+
+@router.get("/search")
+async def search_chats(
+    q: Annotated[str, Query(min_length=1, max_length=500)],
+    x_user_sub: Annotated[str | None, Header()] = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = SEARCH_MAX_RESULTS,
+):
+    """
+    Search the titles and messages of the user's chats. Reads only the postings of the query terms.
+    """
+    terms = query_terms(q)
+
+    if not terms:
+        return FastJSONResponse({"items": []})
+
+    *postings, document_count = await asyncio.gather(
+        *(asyncio.to_thread(get_search_postings_from_db, x_user_sub, term) for term in terms),
+        asyncio.to_thread(get_search_document_count_from_db, x_user_sub),
+    )
+
+    items = rank_search_hits(terms, dict(zip(terms, postings, strict=True)), document_count, limit)
+    return FastJSONResponse({"items": items})
 
 
 @router.get("/{resource_id}")
@@ -44,7 +86,51 @@ def get_chat(resource_id: str, x_user_sub: Annotated[str | None, Header()] = Non
     if chat["userId"] != x_user_sub:
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
-    return chat
+    return FastJSONResponse(chat)
+
+
+@router.delete("/{resource_id}")
+async def delete_chat(resource_id: str, x_user_sub: Annotated[str | None, Header()] = None):
+    """
+    Delete a chat with its messages and the files they reference. A running answer is stopped first.
+    """
+    chat = await asyncio.to_thread(find_chat_by_resource_id, resource_id)
+
+    if chat is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+
+    if chat["userId"] != x_user_sub:
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    if not await stop_chat_streams(resource_id, x_user_sub):
+        # The stream would save its answer into the deleted chat. The client can retry.
+        return Response(status_code=status.HTTP_409_CONFLICT)
+
+    await close_tool_sessions(resource_id, x_user_sub)
+    await asyncio.to_thread(delete_chats, x_user_sub, [chat])
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/delete")
+async def delete_many_chats(request: DeleteChats, x_user_sub: Annotated[str | None, Header()] = None):
+    """
+    Delete chats with their messages and the files they reference. Chats that do not exist are skipped. Running answers are stopped first.
+    """
+    resource_ids = list(dict.fromkeys(request.resourceIds))
+    chats = [chat for chat in await asyncio.gather(*(asyncio.to_thread(find_chat_by_resource_id, x) for x in resource_ids)) if chat is not None]
+
+    if any(chat["userId"] != x_user_sub for chat in chats):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    if chats:
+        if not all(await asyncio.gather(*(stop_chat_streams(chat["resourceId"], x_user_sub) for chat in chats))):
+            return Response(status_code=status.HTTP_409_CONFLICT)
+
+        await asyncio.gather(*(close_tool_sessions(chat["resourceId"], x_user_sub) for chat in chats))
+        await asyncio.to_thread(delete_chats, x_user_sub, chats)
+
+    return FastJSONResponse({"deleted": [chat["resourceId"] for chat in chats]})
 
 
 @router.post("/{resource_id}/messages")
@@ -57,7 +143,7 @@ def create_messages(
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
     messages_in_table = create_messages_in_db(resource_id, x_user_sub, request.messages)
-    return messages_in_table
+    return FastJSONResponse(messages_in_table)
 
 
 @router.put("/{resource_id}/messages")
@@ -69,17 +155,36 @@ def update_messages(
     if not is_chat_mine(resource_id, x_user_sub):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
-    messages_updated = update_messages_in_db(request.messages)
-    return messages_updated
+    results = update_messages_in_db(resource_id, x_user_sub, request.messages)
+    all_updated = all(x["status"] == "updated" for x in results)
+
+    # On conflict, the client reloads the messages and retries the updates that were not applied
+    return FastJSONResponse(results, status_code=status.HTTP_200_OK if all_updated else status.HTTP_409_CONFLICT)
 
 
 @router.get("/{resource_id}/messages")
-def get_messages(resource_id: str, x_user_sub: Annotated[str | None, Header()] = None):
+def get_messages(
+    resource_id: str,
+    x_user_sub: Annotated[str | None, Header()] = None,
+    since: str | None = None,
+):
+    if not is_chat_mine(resource_id, x_user_sub):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    items = get_messages_from_db(resource_id, since)
+    return FastJSONResponse(items)
+
+
+@router.delete("/{resource_id}/sessions")
+async def delete_tool_sessions(resource_id: str, x_user_sub: Annotated[str | None, Header()] = None):
+    """
+    Tear down the code interpreter and browser sessions kept warm for the chat
+    """
     if not is_chat_mine(resource_id, x_user_sub):
         return Response(status_code=status.HTTP_403_FORBIDDEN)
 
-    items = get_messages_from_db(resource_id)
-    return items
+    await close_tool_sessions(resource_id, x_user_sub)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.post("/{resource_id}/title")
@@ -0,0 +1,23 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
+
+from services.export_service import export_user_data
+
+router = APIRouter(prefix="/api/export", tags=["export"])
+
+
+@router.get("")
+async def export(x_user_sub: Annotated[str | None, Header()] = None):
+    """
+    Export all chats, messages and gallery items of the user as NDJSON (gzip/brotli with Accept-Encoding)
+    """
+    return StreamingResponse(
+        export_user_data(x_user_sub),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": 'attachment; filename="export.ndjson"',
+            "Cache-Control": "no-store",
+        },
+    )
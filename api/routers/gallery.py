@@ -1,21 +1,25 @@
-from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Response, status
 
-from database import get_gallery_items_from_db
+from cache import LIST_CACHE_CONTROL, etag_matches, get_list_page, list_etag
+from database import get_gallery_items_from_db, get_list_version
+from responses import FastJSONResponse
 
 router = APIRouter()
 
 
 @router.get("/api/gallery", response_model=dict)
-def get_gallery_items(x_user_sub: str = Header(...), limit: int | None = Query(20, ge=1, le=100), exclusive_start_key: str | None = Query(None)):
+def get_gallery_items(x_user_sub: str = Header(...), if_none_match: str | None = Header(None), limit: int | None = Query(20, ge=1, le=100), exclusive_start_key: str | None = Query(None)):
     """Get gallery items for the current user, ordered by upload time (newest first)"""
     try:
-        result = get_gallery_items_from_db(x_user_sub, exclusive_start_key, limit)
+        version = get_list_version(x_user_sub, "gallery")
+        etag = list_etag(x_user_sub, "gallery", version, exclusive_start_key, limit)
+        headers = {"ETag": etag, "Cache-Control": LIST_CACHE_CONTROL}
 
-        # Convert items to GalleryItem format for response
-        gallery_items = []
-        for item in result["items"]:
-            gallery_items.append({"bucket": item["bucket"], "key": item["key"], "bucketRegion": item["bucketRegion"], "filename": item["filename"], "uploadedAt": item["uploadedAt"], "userId": item["userId"]})
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-        return {"items": gallery_items, "lastEvaluatedKey": result["lastEvaluatedKey"]}
+        # Items are projected to the GalleryItem attributes by the query
+        result = get_list_page(x_user_sub, "gallery", version, (exclusive_start_key, limit), lambda: get_gallery_items_from_db(x_user_sub, exclusive_start_key, limit))
+        return FastJSONResponse(result, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve gallery items: {str(e)}") from e
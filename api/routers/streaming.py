@@ -1,19 +1,54 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Header, Response, status
 from fastapi.responses import StreamingResponse
 
-from database import find_chat_by_resource_id
-from models import CreateChat, CreateTitle, StreamingRequest
+from config import STREAM_QUEUE_RETRY_AFTER_SECONDS
+from database import claim_stream_in_db, find_chat_by_resource_id, get_stream_from_db, is_chat_mine
+from logs import set_log_chat_id
+from models import CancelStreamingRequest, CreateChat, CreateTitle, StreamingRequest
 from routers.chat import create_chat, create_title
+from services.admission_service import AdmissionRejectedError, admission_controller
+from services.stream_registry_service import ActiveStream, find_active_stream, follow_stream, is_draining, request_stream_cancel, start_stream
 from services.streaming_service import process_streaming_request
+from utils import stream_chunk, stream_queue_position_chunk
 
 router = APIRouter(prefix="/api", tags=["streaming"])
 
 
 @router.post("/streaming")
 async def streaming(request: StreamingRequest, x_user_sub: Annotated[str | None, Header()] = None):
+    # Requests are idempotent on the assistant message: retries and double submits
+    # subscribe to the running generation or replay the finished one
+    set_log_chat_id(request.resourceId)
+    assistant_message_id = request.assistantMessage.resourceId
+    active_stream = find_active_stream(request.resourceId, assistant_message_id)
+
+    if active_stream is not None:
+        if active_stream.user_id != x_user_sub:
+            return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+        logging.info(f"chat={request.resourceId} message={assistant_message_id} attached to the running stream")
+        return StreamingResponse(active_stream.subscribe(), media_type="text/event-stream")
+
+    if is_draining():
+        # Shutting down: the client retries on another instance or worker
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+    if admission_controller.is_queue_full():
+        # Overloaded: fail fast instead of queueing behind the throttled streams. The client retries later.
+        return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": str(STREAM_QUEUE_RETRY_AFTER_SECONDS)})
+
+    if not claim_stream_in_db(request.resourceId, assistant_message_id, x_user_sub):
+        stream_item = get_stream_from_db(request.resourceId, assistant_message_id)
+
+        if stream_item is not None and stream_item["userId"] != x_user_sub:
+            return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+        logging.info(f"chat={request.resourceId} message={assistant_message_id} served by another request. following it.")
+        return StreamingResponse(follow_stream(request.resourceId, assistant_message_id), media_type="text/event-stream")
+
     chat = find_chat_by_resource_id(request.resourceId)
     chat_exists = chat is not None
 
@@ -22,11 +57,42 @@ async def streaming(request: StreamingRequest, x_user_sub: Annotated[str | None,
         create_chat(CreateChat(resourceId=request.resourceId), x_user_sub)
         create_title(CreateTitle(messages=[request.userMessage]), request.resourceId, x_user_sub)
 
-    async def generate():
-        async for chunk in process_streaming_request(request, x_user_sub, chat_exists):
-            yield chunk
+    async def generate(stream: ActiveStream):
+        model_key = (request.modelId, request.modelRegion)
+
+        try:
+            async for position in admission_controller.admit(x_user_sub, model_key):
+                yield stream_queue_position_chunk(position)
+        except AdmissionRejectedError as e:
+            logging.warning(f"chat={request.resourceId} stream not admitted: {str(e)}")
+            yield stream_chunk("Sorry, the AI service is currently experiencing high traffic. Please try again in a few moments.")
+            return
+
+        stream.replayable = True
+
+        try:
+            async for chunk in process_streaming_request(request, x_user_sub, chat_exists):
+                yield chunk
+        finally:
+            admission_controller.release(x_user_sub, model_key)
+
+    stream = start_stream(request.resourceId, assistant_message_id, x_user_sub, generate)
 
     return StreamingResponse(
-        generate(),
+        stream.subscribe(),
         media_type="text/event-stream",
     )
+
+
+@router.post("/streaming/{resource_id}/cancel")
+async def cancel_streaming(request: CancelStreamingRequest, resource_id: str, x_user_sub: Annotated[str | None, Header()] = None):
+    """
+    Stop generating the assistant message. The partial answer is saved by the stream.
+    """
+    set_log_chat_id(resource_id)
+
+    if not is_chat_mine(resource_id, x_user_sub):
+        return Response(status_code=status.HTTP_403_FORBIDDEN)
+
+    await request_stream_cancel(resource_id, request.assistantMessageId, x_user_sub)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
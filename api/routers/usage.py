@@ -0,0 +1,32 @@
+from datetime import UTC, datetime, timedelta
+from typing import Annotated
+
+from fastapi import APIRouter, Header, Query
+
+from database import get_usage_from_db
+from responses import FastJSONResponse
+from services.usage_service import summarize_usage
+
+router = APIRouter(prefix="/api/usage", tags=["usage"])
+
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+@router.get("")
+def get_usage(
+    x_user_sub: Annotated[str | None, Header()] = None,
+    start: Annotated[str | None, Query(pattern=DAY_PATTERN)] = None,
+    end: Annotated[str | None, Query(pattern=DAY_PATTERN)] = None,
+):
+    """
+    Token usage and latency totals of the user, overall, per model and per region, between two UTC days (inclusive). Defaults to the last 30 days.
+    """
+    if end is None:
+        end = datetime.now(UTC).strftime("%Y-%m-%d")
+
+    if start is None:
+        start = (datetime.strptime(end, "%Y-%m-%d") - timedelta(days=29)).strftime("%Y-%m-%d")
+
+    items = get_usage_from_db(x_user_sub, start, end)
+
+    return FastJSONResponse({"start": start, "end": end, **summarize_usage(items)})
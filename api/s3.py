@@ -1,17 +1,20 @@
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from uuid import uuid4
 
-import boto3
 from botocore.client import Config
 
-from config import BUCKET, WORKSPACE_DIR
+from aws import get_boto_session
+from config import BUCKET, DELETE_CONCURRENCY, WORKSPACE_DIR
 
 
+@functools.cache
 def get_s3_client():
-    return boto3.client(
+    """Client shared by every request (and its connection pool)"""
+    return get_boto_session().client(
         "s3",
-        region_name=os.environ["AWS_REGION"],
         config=Config(signature_version="s3v4"),
     )
 
@@ -35,6 +38,23 @@ def download_s3_file_on_memory(key: str) -> bytes:
     return dl_obj_binary
 
 
+def delete_s3_objects(keys: list[str]) -> None:
+    """Delete objects of the bucket with DeleteObjects requests of 1000 keys sent in parallel"""
+    if not keys:
+        return
+
+    s3 = get_s3_client()
+
+    def delete(chunk: list[str]) -> None:
+        res = s3.delete_objects(Bucket=BUCKET, Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True})
+
+        if res.get("Errors"):
+            raise RuntimeError(f"Failed to delete {len(res['Errors'])} objects: {res['Errors'][0].get('Message')}")
+
+    with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        list(executor.map(delete, [keys[i : i + 1000] for i in range(0, len(keys), 1000)]))
+
+
 def upload_file_to_s3(filepath: str, session_workspace_dir: str = None, x_user_sub: str = None) -> str:
     """Upload the file at session workspace and retrieve the s3 path
 
@@ -59,7 +79,7 @@ def upload_file_to_s3(filepath: str, session_workspace_dir: str = None, x_user_s
     filename = os.path.basename(filepath)
     key = f"{datetime_prefix}/{random_prefix}_{filename}"
 
-    s3 = boto3.client("s3")
+    s3 = get_s3_client()
     s3.upload_file(filepath, BUCKET, key)
     s3_url = f"https://{BUCKET}.s3.{region}.amazonaws.com/{key}"
 
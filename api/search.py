@@ -0,0 +1,77 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from config import SEARCH_MAX_QUERY_TERMS, SEARCH_MAX_TERM_LENGTH, SEARCH_MAX_TERMS_PER_DOCUMENT, SEARCH_TITLE_WEIGHT
+
+# Scripts written without spaces (kana, CJK ideographs, hangul) are indexed as character bigrams
+CJK_RANGES = ((0x3040, 0x30FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xAC00, 0xD7AF), (0xF900, 0xFAFF))
+CJK_CHARS = "".join(f"{chr(start)}-{chr(end)}" for start, end in CJK_RANGES)
+TOKEN_PATTERN = re.compile(f"[{CJK_CHARS}]+|[^\\W_{CJK_CHARS}]+")
+CJK_PATTERN = re.compile(f"[{CJK_CHARS}]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into search terms: lowercase words, and bigrams of CJK runs"""
+    terms = []
+
+    for run in TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if CJK_PATTERN.match(run):
+            terms.extend([run] if len(run) == 1 else [run[i : i + 2] for i in range(len(run) - 1)])
+        elif len(run) <= SEARCH_MAX_TERM_LENGTH:
+            terms.append(run)
+
+    return terms
+
+
+def term_frequencies(text: str) -> dict[str, int]:
+    """Frequencies of the terms of a document, limited to its most frequent terms"""
+    return dict(Counter(tokenize(text)).most_common(SEARCH_MAX_TERMS_PER_DOCUMENT))
+
+
+def message_term_frequencies(content: list[dict]) -> dict[str, int]:
+    return term_frequencies("\n".join(c["text"] for c in content if "text" in c))
+
+
+def query_terms(q: str) -> list[str]:
+    return list(dict.fromkeys(tokenize(q)))[:SEARCH_MAX_QUERY_TERMS]
+
+
+def rank_search_hits(terms: list[str], postings_by_term: dict[str, list[dict]], document_count: int, limit: int) -> list[dict]:
+    """Rank the chats and messages of the postings with tf-idf
+
+    Hits matching only some of the terms are scored down in proportion.
+
+    Args:
+        terms: Terms of the query
+        postings_by_term: Posting items read for each term
+        document_count: Number of indexed messages of the user
+        limit: Maximum number of hits
+    """
+    hits = {}
+
+    for term, postings in postings_by_term.items():
+        if not postings:
+            continue
+
+        idf = math.log(1 + max(document_count, len(postings)) / len(postings))
+
+        for p in postings:
+            hit = hits.setdefault(
+                p["orderBy"],
+                {
+                    "chatId": p["chatId"],
+                    "messageId": p.get("messageId"),
+                    "score": 0.0,
+                    "terms": [],
+                },
+            )
+            weight = SEARCH_TITLE_WEIGHT if p.get("messageId") is None else 1
+            hit["score"] += weight * (1 + math.log(int(p["tf"]))) * idf
+            hit["terms"].append(term)
+
+    for hit in hits.values():
+        hit["score"] = round(hit["score"] * len(hit["terms"]) / len(terms), 4)
+
+    return sorted(hits.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
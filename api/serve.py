@@ -0,0 +1,37 @@
+"""Serve the API with several worker processes, for containers (ECS, Kubernetes, ...)
+
+The default entrypoint runs a single process, as Lambda sends one request at a time to each
+instance. In a container, run this instead to use every core:
+
+    docker run --entrypoint python -p 8080:8080 <image> serve.py
+
+WEB_CONCURRENCY sets the number of workers (default: one per core). uvicorn picks up uvloop
+and httptools, which are dependencies of the API. On SIGTERM every worker stops accepting new
+streams, lets the running ones finish for STREAM_DRAIN_SECONDS and then cleans up (see lifespan
+in main.py).
+"""
+
+import os
+
+import uvicorn
+
+from config import STREAM_DRAIN_SECONDS
+
+
+def main():
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8080")),
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",
+        http="auto",
+        # Streams are stopped and saved by the lifespan shutdown once STREAM_DRAIN_SECONDS have passed
+        timeout_graceful_shutdown=STREAM_DRAIN_SECONDS,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+    )
+
+
+if __name__ == "__main__":
+    main()
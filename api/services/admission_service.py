@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from config import (
+    MAX_STREAMS_PER_MODEL,
+    MAX_STREAMS_PER_USER,
+    MIN_STREAMS_PER_MODEL,
+    STREAM_QUEUE_MAX_SIZE,
+    STREAM_QUEUE_MAX_WAIT_SECONDS,
+    THROTTLE_DECREASE_COOLDOWN_SECONDS,
+)
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a stream cannot be admitted within the bounded wait"""
+
+
+@dataclass
+class _Waiter:
+    user_id: str
+    model_key: tuple[str, str]
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class AdmissionController:
+    """Caps concurrent Bedrock streams per user and per (modelId, region)
+
+    The per-model limit follows AIMD: it is halved when Bedrock throttles
+    (at most once per cooldown, so one burst counts as one signal) and grows
+    back by 1/limit on every stream that finishes without throttling.
+
+    The limits are per process. With Lambda, which sends one request at a time to each
+    instance, they never hold a stream back: they take effect with the container workers
+    (see serve.py), which serve many streams each.
+    """
+
+    def __init__(
+        self,
+        max_streams_per_user: int = MAX_STREAMS_PER_USER,
+        max_streams_per_model: int = MAX_STREAMS_PER_MODEL,
+        min_streams_per_model: int = MIN_STREAMS_PER_MODEL,
+        max_queue_size: int = STREAM_QUEUE_MAX_SIZE,
+        max_wait_seconds: float = STREAM_QUEUE_MAX_WAIT_SECONDS,
+        decrease_cooldown_seconds: float = THROTTLE_DECREASE_COOLDOWN_SECONDS,
+    ):
+        self.max_streams_per_user = max_streams_per_user
+        self.max_streams_per_model = max_streams_per_model
+        self.min_streams_per_model = min_streams_per_model
+        self.max_queue_size = max_queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self.decrease_cooldown_seconds = decrease_cooldown_seconds
+
+        self._active_per_user: dict[str, int] = {}
+        self._active_per_model: dict[tuple[str, str], int] = {}
+        self._model_limits: dict[tuple[str, str], float] = {}
+        self._last_decrease: dict[tuple[str, str], float] = {}
+        self._waiters: list[_Waiter] = []
+
+    def model_limit(self, model_key: tuple[str, str]) -> int:
+        return max(self.min_streams_per_model, int(self._model_limits.get(model_key, self.max_streams_per_model)))
+
+    def _has_capacity(self, user_id: str, model_key: tuple[str, str]) -> bool:
+        if self._active_per_user.get(user_id, 0) >= self.max_streams_per_user:
+            return False
+
+        return self._active_per_model.get(model_key, 0) < self.model_limit(model_key)
+
+    def _try_admit(self, waiter: _Waiter) -> bool:
+        if not self._has_capacity(waiter.user_id, waiter.model_key):
+            return False
+
+        # FIFO per model: earlier waiters go first unless their own user cap blocks them
+        for w in self._waiters:
+            if w is waiter:
+                break
+            if w.model_key == waiter.model_key and self._active_per_user.get(w.user_id, 0) < self.max_streams_per_user:
+                return False
+
+        self._waiters.remove(waiter)
+        self._active_per_user[waiter.user_id] = self._active_per_user.get(waiter.user_id, 0) + 1
+        self._active_per_model[waiter.model_key] = self._active_per_model.get(waiter.model_key, 0) + 1
+        # Let the remaining waiters report their new position
+        self._wake_waiters()
+        return True
+
+    def _position(self, waiter: _Waiter) -> int:
+        position = 1
+        for w in self._waiters:
+            if w is waiter:
+                break
+            if w.model_key == waiter.model_key:
+                position += 1
+        return position
+
+    def _wake_waiters(self) -> None:
+        for w in self._waiters:
+            w.wakeup.set()
+
+    def is_queue_full(self) -> bool:
+        return len(self._waiters) >= self.max_queue_size
+
+    async def admit(self, user_id: str, model_key: tuple[str, str]) -> AsyncIterator[int]:
+        """Wait for a stream slot, yielding the queue position whenever it changes
+
+        The slot is held once the iteration finishes and must be given back with release().
+
+        Raises:
+            AdmissionRejectedError: The queue is full or the bounded wait expired
+        """
+        if self.is_queue_full():
+            raise AdmissionRejectedError(f"queue is full ({len(self._waiters)} waiting)")
+
+        waiter = _Waiter(user_id=user_id, model_key=model_key)
+        self._waiters.append(waiter)
+        deadline = time.monotonic() + self.max_wait_seconds
+        last_position = None
+
+        try:
+            while not self._try_admit(waiter):
+                position = self._position(waiter)
+
+                if position != last_position:
+                    last_position = position
+                    yield position
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    raise AdmissionRejectedError(f"not admitted within {self.max_wait_seconds} seconds")
+
+                waiter.wakeup.clear()
+
+                try:
+                    await asyncio.wait_for(waiter.wakeup.wait(), timeout=remaining)
+                except TimeoutError:
+                    pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._wake_waiters()
+
+    def release(self, user_id: str, model_key: tuple[str, str]) -> None:
+        self._active_per_user[user_id] = self._active_per_user.get(user_id, 1) - 1
+        if self._active_per_user[user_id] <= 0:
+            del self._active_per_user[user_id]
+
+        self._active_per_model[model_key] = self._active_per_model.get(model_key, 1) - 1
+        if self._active_per_model[model_key] <= 0:
+            del self._active_per_model[model_key]
+
+        self._wake_waiters()
+
+    def record_throttle(self, model_key: tuple[str, str]) -> None:
+        """Multiplicative decrease of the model limit when Bedrock throttles"""
+        now = time.monotonic()
+
+        last_decrease = self._last_decrease.get(model_key)
+
+        if last_decrease is not None and now - last_decrease < self.decrease_cooldown_seconds:
+            return
+
+        self._last_decrease[model_key] = now
+        limit = self._model_limits.get(model_key, self.max_streams_per_model)
+        self._model_limits[model_key] = max(self.min_streams_per_model, limit / 2)
+        logging.warning(f"Bedrock throttling for model={model_key[0]} region={model_key[1]}. stream limit {limit:.1f} -> {self._model_limits[model_key]:.1f}")
+
+    def record_success(self, model_key: tuple[str, str]) -> None:
+        """Additive increase of the model limit after a stream without throttling"""
+        limit = self._model_limits.get(model_key, self.max_streams_per_model)
+
+        if limit >= self.max_streams_per_model:
+            return
+
+        self._model_limits[model_key] = min(self.max_streams_per_model, limit + 1 / limit)
+        self._wake_waiters()
+
+
+admission_controller = AdmissionController()
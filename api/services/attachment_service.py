@@ -0,0 +1,241 @@
+import asyncio
+import io
+import logging
+import re
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+import pypdf
+from PIL import Image, ImageOps
+
+from config import (
+    ATTACHMENT_DERIVATIVE_CACHE_MAX_ENTRIES,
+    ATTACHMENT_IMAGE_JPEG_QUALITY,
+    ATTACHMENT_IMAGE_MAX_BYTES,
+    ATTACHMENT_IMAGE_MAX_DIMENSION,
+    ATTACHMENT_PREPROCESS_CONCURRENCY,
+    BUCKET,
+)
+from models import MessageNotInTable
+from s3 import download_s3_file_on_memory, get_s3_client
+
+# Part of the derivative keys. Changing the settings creates new derivatives instead of reusing the old ones.
+IMAGE_DERIVATIVE_VERSION = f"max{ATTACHMENT_IMAGE_MAX_DIMENSION}q{ATTACHMENT_IMAGE_JPEG_QUALITY}"
+TEXT_DERIVATIVE_VERSION = "text1"
+
+# Office documents are zip archives of XML parts. Larger parts are not extracted.
+MAX_OFFICE_PART_BYTES = 50 * 1024 * 1024
+
+# (s3Key, version) -> derived fields, for messages saved before the derived fields were recorded
+_derivatives: OrderedDict[tuple[str, str], dict[str, str]] = OrderedDict()
+
+
+def _derivative_version(c: dict) -> str | None:
+    if c.get("type") == "image" and c.get("extension") != "gif":
+        # Animated GIFs are sent as they are
+        return IMAGE_DERIVATIVE_VERSION
+    if c.get("type") == "document" and c.get("extension") in ("pdf", "docx", "xlsx", "pptx"):
+        return TEXT_DERIVATIVE_VERSION
+    return None
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _read_office_part(archive: zipfile.ZipFile, name: str) -> ElementTree.Element:
+    if archive.getinfo(name).file_size > MAX_OFFICE_PART_BYTES:
+        raise ValueError(f"{name} is too large to extract")
+    return ElementTree.fromstring(archive.read(name))
+
+
+def _paragraphs(root: ElementTree.Element, paragraph_tag: str) -> list[str]:
+    paragraphs = []
+
+    for p in root.iter():
+        if _local_name(p.tag) == paragraph_tag:
+            text = "".join(t.text or "" for t in p.iter() if _local_name(t.tag) == "t")
+            if text:
+                paragraphs.append(text)
+
+    return paragraphs
+
+
+def _numbered_parts(archive: zipfile.ZipFile, pattern: str) -> list[str]:
+    names = [name for name in archive.namelist() if re.fullmatch(pattern, name)]
+    return sorted(names, key=lambda name: int(re.search(r"(\d+)\.xml$", name).group(1)))
+
+
+def _extract_docx(archive: zipfile.ZipFile) -> str:
+    return "\n".join(_paragraphs(_read_office_part(archive, "word/document.xml"), "p"))
+
+
+def _extract_pptx(archive: zipfile.ZipFile) -> str:
+    slides = []
+
+    for i, name in enumerate(_numbered_parts(archive, r"ppt/slides/slide\d+\.xml"), start=1):
+        slides.append(f"## Slide {i}\n" + "\n".join(_paragraphs(_read_office_part(archive, name), "p")))
+
+    return "\n\n".join(slides)
+
+
+def _extract_xlsx(archive: zipfile.ZipFile) -> str:
+    shared_strings = []
+
+    if "xl/sharedStrings.xml" in archive.namelist():
+        for si in _read_office_part(archive, "xl/sharedStrings.xml"):
+            shared_strings.append("".join(t.text or "" for t in si.iter() if _local_name(t.tag) == "t"))
+
+    sheets = []
+
+    for i, name in enumerate(_numbered_parts(archive, r"xl/worksheets/sheet\d+\.xml"), start=1):
+        rows = []
+
+        for row in _read_office_part(archive, name).iter():
+            if _local_name(row.tag) != "row":
+                continue
+
+            values = []
+
+            for cell in row:
+                if _local_name(cell.tag) != "c":
+                    continue
+
+                if cell.get("t") == "inlineStr":
+                    values.append("".join(t.text or "" for t in cell.iter() if _local_name(t.tag) == "t"))
+                    continue
+
+                value = next((v.text or "" for v in cell if _local_name(v.tag) == "v"), "")
+                values.append(shared_strings[int(value)] if cell.get("t") == "s" and value else value)
+
+            if any(values):
+                rows.append("\t".join(values))
+
+        sheets.append(f"## Sheet {i}\n" + "\n".join(rows))
+
+    return "\n\n".join(sheets)
+
+
+def extract_document_text(data: bytes, extension: str) -> str:
+    """Extract the text of a PDF or Office (docx, xlsx, pptx) document"""
+    if extension == "pdf":
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages).strip()
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        if extension == "docx":
+            return _extract_docx(archive).strip()
+        if extension == "pptx":
+            return _extract_pptx(archive).strip()
+        return _extract_xlsx(archive).strip()
+
+
+def downscale_image(data: bytes) -> tuple[bytes, str] | None:
+    """Downscale an image to ATTACHMENT_IMAGE_MAX_DIMENSION and re-encode it
+
+    Returns the encoded image and its format, or None when the original is already small enough.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= ATTACHMENT_IMAGE_MAX_DIMENSION and len(data) <= ATTACHMENT_IMAGE_MAX_BYTES:
+            return None
+
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((ATTACHMENT_IMAGE_MAX_DIMENSION, ATTACHMENT_IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "png"
+
+        image.convert("RGB").save(output, format="JPEG", quality=ATTACHMENT_IMAGE_JPEG_QUALITY, optimize=True)
+        return output.getvalue(), "jpeg"
+
+
+def create_derivative(c: dict, version: str) -> dict[str, str]:
+    """Create the derivative of an attachment next to the original S3 object and return its derived fields
+
+    When the original is fine as it is, the derived fields point to the original.
+
+    Args:
+        c: Content of the attachment (type, extension, s3Key)
+        version: Derivative version from _derivative_version
+    """
+    key = c["s3Key"]
+    data = download_s3_file_on_memory(key)
+    derived = None
+
+    if c["type"] == "image":
+        image = downscale_image(data)
+        if image is not None:
+            derived = (image[0], image[1], f"image/{image[1]}")
+    else:
+        text = extract_document_text(data, c["extension"])
+        # Nothing to extract (e.g. a scanned PDF): the model reads the original
+        if text:
+            derived = (text.encode("utf-8"), "txt", "text/plain; charset=utf-8")
+
+    if derived is None:
+        return {"derivedS3Key": key, "derivedExtension": c["extension"], "derivedVersion": version}
+
+    body, extension, content_type = derived
+    derived_key = f"{key}.{version}.{extension}"
+    get_s3_client().put_object(Bucket=BUCKET, Key=derived_key, Body=body, ContentType=content_type)
+    logging.info(f"Created derivative {derived_key} ({len(data)} -> {len(body)} bytes)")
+
+    return {"derivedS3Key": derived_key, "derivedExtension": extension, "derivedVersion": version}
+
+
+def _prepare_content(c: dict, version: str) -> None:
+    cache_key = (c["s3Key"], version)
+    derived = _derivatives.get(cache_key)
+
+    if derived is None:
+        try:
+            derived = create_derivative(c, version)
+        except Exception as e:
+            # The original is sent instead
+            logging.warning(f"Failed to preprocess attachment {c['s3Key']}: {str(e)}")
+            return
+
+        _derivatives[cache_key] = derived
+
+        if len(_derivatives) > ATTACHMENT_DERIVATIVE_CACHE_MAX_ENTRIES:
+            _derivatives.popitem(last=False)
+    else:
+        _derivatives.move_to_end(cache_key)
+
+    c.update(derived)
+
+
+async def prepare_attachments(messages: list[MessageNotInTable]) -> None:
+    """Add the derived fields (derivedS3Key, derivedExtension, derivedVersion) to the attachments of the messages
+
+    Derivatives are created once. The derived fields are saved with the messages, so later
+    turns reuse them without touching S3. build_message sends the derivatives.
+
+    Args:
+        messages: Messages whose attachment contents are updated in place
+    """
+    pending = []
+
+    for message in messages:
+        for c in message.content:
+            if "s3Key" not in c:
+                continue
+
+            version = _derivative_version(c)
+
+            if version is not None and c.get("derivedVersion") != version:
+                pending.append((c, version))
+
+    if not pending:
+        return
+
+    semaphore = asyncio.Semaphore(ATTACHMENT_PREPROCESS_CONCURRENCY)
+
+    async def prepare(c: dict, version: str) -> None:
+        async with semaphore:
+            await asyncio.to_thread(_prepare_content, c, version)
+
+    await asyncio.gather(*(prepare(c, version) for c, version in pending))
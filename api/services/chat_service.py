@@ -1,59 +1,65 @@
 import json
 import logging
+import os
 
-import boto3
 from strands import Agent
 from strands.models import BedrockModel
 
-from config import PARAMETER
+from config import BUCKET, PARAMETER, S3_LOCATION_MODEL_ID_PATTERNS
 from database import find_chat_by_resource_id, update_chat_title
 from models import MessageNotInTable
 from s3 import download_s3_file_on_memory
+from services.model_service import get_model
+
+
+def s3_location(key: str) -> dict:
+    return {"uri": f"s3://{BUCKET}/{key}"}
 
 
 def build_message(message: MessageNotInTable) -> dict:
+    """Build a Bedrock message. Attachments are referenced by their S3 location and not downloaded here.
+
+    Images and documents with a derivative (see prepare_attachments) are sent as the derivative.
+    """
     content = []
 
     for c in message.content:
         if "text" in c:
             content.append(c)
-        else:
-            binary = download_s3_file_on_memory(c["s3Key"])
-
-            if c["type"] == "image":
-                content.append(
-                    {
-                        "image": {
-                            "format": c["extension"],
-                            "source": {
-                                "bytes": binary,
-                            },
-                        }
+        elif c["type"] == "image":
+            content.append(
+                {
+                    "image": {
+                        "format": c.get("derivedExtension", c["extension"]),
+                        "source": {
+                            "s3Location": s3_location(c.get("derivedS3Key", c["s3Key"])),
+                        },
                     }
-                )
-            elif c["type"] == "video":
-                content.append(
-                    {
-                        "video": {
-                            "format": c["extension"],
-                            "source": {
-                                "bytes": binary,
-                            },
-                        }
+                }
+            )
+        elif c["type"] == "video":
+            content.append(
+                {
+                    "video": {
+                        "format": c["extension"],
+                        "source": {
+                            "s3Location": s3_location(c["s3Key"]),
+                        },
                     }
-                )
-            else:
-                content.append(
-                    {
-                        "document": {
-                            "format": c["extension"],
-                            "source": {
-                                "bytes": binary,
-                            },
-                            "name": c["name"],
-                        }
+                }
+            )
+        else:
+            content.append(
+                {
+                    "document": {
+                        "format": c.get("derivedExtension", c["extension"]),
+                        "source": {
+                            "s3Location": s3_location(c.get("derivedS3Key", c["s3Key"])),
+                        },
+                        "name": c["name"],
                     }
-                )
+                }
+            )
 
     return {
         "role": message.role,
@@ -61,6 +67,49 @@ def build_message(message: MessageNotInTable) -> dict:
     }
 
 
+def supports_s3_location(model_id: str, region: str) -> bool:
+    """Whether the model reads attachments from our bucket by s3Location in the region"""
+    if region != os.environ["AWS_REGION"]:
+        return False
+
+    for m in PARAMETER["models"]:
+        if m["id"] == model_id and "s3Location" in m:
+            return m["s3Location"]
+
+    return any(pattern in model_id for pattern in S3_LOCATION_MODEL_ID_PATTERNS)
+
+
+class AttachmentBedrockModel(BedrockModel):
+    """BedrockModel sending the attachments of build_message by s3Location when the model supports it
+
+    Otherwise the bytes are downloaded when the request is formatted (in the thread
+    reading the stream) and kept for the other model calls of the same turn.
+    """
+
+    def __init__(self, **model_config):
+        super().__init__(**model_config)
+        self.s3_location_supported = supports_s3_location(self.config["model_id"], self.client.meta.region_name)
+        self._attachments: dict[str, bytes] = {}
+
+    def _attachment_bytes(self, uri: str) -> bytes:
+        if uri not in self._attachments:
+            self._attachments[uri] = download_s3_file_on_memory(uri.removeprefix(f"s3://{BUCKET}/"))
+        return self._attachments[uri]
+
+    def _format_request_message_content(self, content: dict) -> dict:
+        for media in ("image", "video", "document"):
+            if media in content and "s3Location" in content[media].get("source", {}):
+                block = content[media]
+
+                if self.s3_location_supported:
+                    # BedrockModel only passes bytes through
+                    return {media: {**{k: block[k] for k in ("format", "name") if k in block}, "source": {"s3Location": block["source"]["s3Location"]}}}
+
+                return super()._format_request_message_content({media: {**block, "source": {"bytes": self._attachment_bytes(block["source"]["s3Location"]["uri"])}}})
+
+        return super()._format_request_message_content(content)
+
+
 def build_messages(messages: list[MessageNotInTable]) -> list[dict]:
     return list(map(build_message, messages))
 
@@ -69,18 +118,9 @@ def generate_chat_title(resource_id: str, messages: list[MessageNotInTable]) ->
     chat = find_chat_by_resource_id(resource_id)
 
     try:
-        messages_json = json.dumps([x.dict() for x in messages], ensure_ascii=False)
-
-        session = boto3.Session(
-            region_name=PARAMETER["createTitleModel"]["region"],
-        )
-
-        model_params = {
-            "model_id": PARAMETER["createTitleModel"]["id"],
-            "boto_session": session,
-        }
+        messages_json = json.dumps([x.model_dump() for x in messages], ensure_ascii=False)
 
-        model = BedrockModel(**model_params)
+        model = get_model(PARAMETER["createTitleModel"]["id"], PARAMETER["createTitleModel"]["region"])
         agent = Agent(model=model)
 
         res = agent(f"""You are a writer who generates titles from conversation history. Titles should be concise (within 20 characters) and include important context from the exchange.
@@ -0,0 +1,99 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from config import BUCKET, DELETE_CONCURRENCY
+from database import bump_list_version, delete_items_in_db, get_partition_page_from_db, search_posting_key, update_search_document_count
+from s3 import delete_s3_objects
+from search import message_term_frequencies, term_frequencies
+
+# URLs of the files uploaded by tools (see upload_file_to_s3), found in the message texts
+S3_URL_PATTERN = re.compile(re.escape(f"https://{BUCKET}.s3.") + r"[a-z0-9-]+\.amazonaws\.com/([^\s)\"'<>\]]+)")
+
+
+def _item_key(item: dict) -> dict:
+    return {"queryId": item["queryId"], "orderBy": item["orderBy"]}
+
+
+def _read_partition(query_id: str):
+    exclusive_start_key = None
+
+    while True:
+        items, exclusive_start_key = get_partition_page_from_db(query_id, exclusive_start_key)
+        yield from items
+
+        if exclusive_start_key is None:
+            return
+
+
+def _referenced_files(content: list[dict]) -> set[str]:
+    keys = set()
+
+    for c in content:
+        if "text" in c:
+            keys.update(unquote(key) for key in S3_URL_PATTERN.findall(c["text"]))
+        elif "s3Key" in c:
+            keys.add(c["s3Key"])
+            keys.add(c.get("derivedS3Key", c["s3Key"]))
+
+    return keys
+
+
+def _collect_chat(x_user_sub: str, chat: dict) -> tuple[list[dict], set[str], int]:
+    # Keys of the items of the chat (messages, stream records, search postings), files referenced by its messages, and number of indexed messages
+    resource_id = chat["resourceId"]
+    keys = [search_posting_key(x_user_sub, term, resource_id, None) for term in term_frequencies(chat.get("title", ""))]
+    files = set()
+    documents = 0
+
+    for query_id in (f"{resource_id}$message", f"{resource_id}$stream", f"{resource_id}$cancel"):
+        for item in _read_partition(query_id):
+            keys.append(_item_key(item))
+
+            if item.get("dataType") == "message":
+                terms = message_term_frequencies(item["content"])
+                keys.extend(search_posting_key(x_user_sub, term, resource_id, item["resourceId"]) for term in terms)
+                documents += 1 if terms else 0
+                files |= _referenced_files(item["content"])
+
+    return keys, files, documents
+
+
+def _delete_chat_files(x_user_sub: str, files: set[str]) -> None:
+    # Only files of the user are deleted: attachments under the user's prefix, and files of the user's gallery
+    keys = {key for key in files if key.startswith(f"{x_user_sub}/")}
+    gallery_items = [item for item in _read_partition(f"{x_user_sub}$gallery") if item["key"] in files]
+    keys.update(item["key"] for item in gallery_items)
+
+    delete_s3_objects(sorted(keys))
+
+    if gallery_items:
+        delete_items_in_db([_item_key(item) for item in gallery_items])
+        bump_list_version(x_user_sub, "gallery")
+
+    logging.info(f"Deleted {len(keys)} files and {len(gallery_items)} gallery items of user {x_user_sub}")
+
+
+def delete_chats(x_user_sub: str, chats: list[dict]) -> None:
+    """Delete chats with their messages, stream records, search postings and the files their messages reference
+
+    The files are deleted first, while the messages referencing them can still be read,
+    and the chat items last. A failed deletion can be retried.
+
+    Args:
+        x_user_sub: User ID
+        chats: Chat items of the user
+    """
+    with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+        collected = list(executor.map(lambda chat: _collect_chat(x_user_sub, chat), chats))
+
+    _delete_chat_files(x_user_sub, set().union(*(files for _, files, _ in collected)))
+
+    delete_items_in_db([key for keys, _, _ in collected for key in keys])
+    delete_items_in_db([_item_key(chat) for chat in chats])
+
+    update_search_document_count(x_user_sub, -sum(documents for _, _, documents in collected))
+    bump_list_version(x_user_sub, "chat")
+
+    logging.info(f"Deleted {len(chats)} chats of user {x_user_sub}")
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+
+from config import EXPORT_CHUNK_BYTES, EXPORT_CONCURRENCY
+from database import get_partition_page_from_db
+from responses import dumps_json
+
+
+def _line(record_type: str, item: dict) -> bytes:
+    return dumps_json({"type": record_type, "item": item}) + b"\n"
+
+
+async def _read_partition(query_id: str) -> AsyncIterator[list[dict]]:
+    exclusive_start_key = None
+
+    while True:
+        items, exclusive_start_key = await asyncio.to_thread(get_partition_page_from_db, query_id, exclusive_start_key)
+        yield items
+
+        if exclusive_start_key is None:
+            return
+
+
+async def export_user_data(x_user_sub: str) -> AsyncIterator[bytes]:
+    """Stream the chats, messages and gallery items of a user as NDJSON
+
+    Each line is {"type": "chat" | "message" | "gallery", "item": ...}, and the last one is
+    {"type": "end"} ({"type": "error"} when the export failed). Message partitions are read
+    EXPORT_CONCURRENCY at a time. The queues between the readers and the response are
+    bounded, so memory stays constant however large the account is.
+
+    Args:
+        x_user_sub: User ID
+    """
+    pages: asyncio.Queue[list[bytes] | None] = asyncio.Queue(maxsize=EXPORT_CONCURRENCY * 2)
+    chat_ids: asyncio.Queue[str | None] = asyncio.Queue(maxsize=EXPORT_CONCURRENCY)
+
+    async def read_chats():
+        async for items in _read_partition(f"{x_user_sub}$chat"):
+            await pages.put([_line("chat", x) for x in items])
+
+            for x in items:
+                await chat_ids.put(x["resourceId"])
+
+        # Let the message readers finish
+        for _ in range(EXPORT_CONCURRENCY):
+            await chat_ids.put(None)
+
+    async def read_messages():
+        while (chat_id := await chat_ids.get()) is not None:
+            async for items in _read_partition(f"{chat_id}$message"):
+                await pages.put([_line("message", x) for x in items])
+
+    async def read_gallery():
+        async for items in _read_partition(f"{x_user_sub}$gallery"):
+            await pages.put([_line("gallery", x) for x in items])
+
+    async def produce():
+        try:
+            # A failed reader cancels the others
+            async with asyncio.TaskGroup() as group:
+                group.create_task(read_chats())
+                group.create_task(read_gallery())
+
+                for _ in range(EXPORT_CONCURRENCY):
+                    group.create_task(read_messages())
+        finally:
+            await pages.put(None)
+
+    producer = asyncio.create_task(produce())
+    buffer = bytearray()
+
+    try:
+        while (lines := await pages.get()) is not None:
+            for line in lines:
+                buffer += line
+
+            # Few, large chunks: each one is a separate flush of the compression middleware
+            if len(buffer) >= EXPORT_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+
+        try:
+            await producer
+            buffer += dumps_json({"type": "end"}) + b"\n"
+        except Exception as e:
+            logging.error(f"Export of user {x_user_sub} failed: {str(e)}", exc_info=True)
+            buffer += dumps_json({"type": "error"}) + b"\n"
+
+        yield bytes(buffer)
+    finally:
+        producer.cancel()
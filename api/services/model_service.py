@@ -0,0 +1,94 @@
+import functools
+from types import MappingProxyType
+
+from botocore.config import Config
+from strands.models import BedrockModel
+from strands.tools.registry import ToolRegistry
+from strands_tools.tavily import tavily_crawl, tavily_extract, tavily_map, tavily_search
+
+from aws import get_boto_session
+from config import BEDROCK_MAX_ATTEMPTS, MODEL_MAX_TOKENS, REASONING_BUDGET_TOKENS
+from tools import BASE_TOOLS, cache_tool_results
+
+BEDROCK_CLIENT_CONFIG = Config(
+    retries={
+        "max_attempts": BEDROCK_MAX_ATTEMPTS,
+        "mode": "standard",
+    },
+    connect_timeout=10,
+    read_timeout=300,
+    user_agent_extra="strands-agents",
+)
+
+
+@functools.cache
+def get_bedrock_client(region: str):
+    """bedrock-runtime client of a region, shared by every model (clients are thread safe)"""
+    return get_boto_session(region).client("bedrock-runtime", config=BEDROCK_CLIENT_CONFIG)
+
+
+class SharedClientSession:
+    """Passed as the boto_session of a BedrockModel, which would otherwise create its own client and connection pool"""
+
+    def __init__(self, region: str):
+        self.region_name = region
+
+    def client(self, **kwargs):
+        return get_bedrock_client(self.region_name)
+
+
+@functools.cache
+def get_model_config(model_id: str, reasoning: bool = False, max_tokens: int | None = None) -> MappingProxyType:
+    """Read-only model config, passed to BedrockModel as keyword arguments"""
+    model_config = {"model_id": model_id}
+
+    if max_tokens is not None:
+        model_config["max_tokens"] = max_tokens
+
+    if reasoning:
+        model_config["additional_request_fields"] = {
+            "thinking": {
+                "type": "enabled",
+                "budget_tokens": REASONING_BUDGET_TOKENS,
+            },
+        }
+
+    return MappingProxyType(model_config)
+
+
+def create_model(model_class: type[BedrockModel], model_id: str, region: str, reasoning: bool = False, max_tokens: int | None = MODEL_MAX_TOKENS, **kwargs) -> BedrockModel:
+    """Create a model holding per-request state (e.g. StoppableBedrockModel) on the cached client and config of its key
+
+    Args:
+        model_class: BedrockModel or a subclass
+        model_id: Bedrock model ID
+        region: Region of the Bedrock client
+        reasoning: Whether extended thinking is enabled
+        max_tokens: Maximum number of output tokens (None for the default of the model)
+        kwargs: Other arguments of model_class
+    """
+    return model_class(**kwargs, **get_model_config(model_id, reasoning, max_tokens), boto_session=SharedClientSession(region))
+
+
+@functools.cache
+def get_model(model_id: str, region: str, reasoning: bool = False, max_tokens: int | None = None) -> BedrockModel:
+    """BedrockModel shared by every request with the same key. Models without per-request state only (e.g. title generation)."""
+    return create_model(BedrockModel, model_id, region, reasoning, max_tokens)
+
+
+@functools.cache
+def get_static_tools(web_search: bool) -> tuple:
+    """Tools that do not depend on the session, for each combination of the tool options that add them
+
+    The upload tool (bound to the session workspace), MCP tools and AgentCore tools are added per request.
+    """
+    tools = list(BASE_TOOLS)
+
+    if web_search:
+        tools += cache_tool_results([tavily_search, tavily_extract, tavily_crawl, tavily_map])
+
+    # Resolve the tool modules into AgentTools with their specs. Every Agent would load them from their file otherwise.
+    registry = ToolRegistry()
+    registry.process_tools(tools)
+
+    return tuple(registry.registry.values())
@@ -0,0 +1,212 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+
+from config import (
+    PARAMETER,
+    ROUTING_DEFAULT_TTFT_SECONDS,
+    ROUTING_HEDGE_DELAY_SECONDS,
+    ROUTING_MIN_SAMPLES,
+    ROUTING_UNHEALTHY_ERROR_RATE,
+    ROUTING_WINDOW_SECONDS,
+)
+
+
+def is_first_token_event(event: dict) -> bool:
+    """Check whether the agent event carries the first output of the model (text, reasoning or tool use)"""
+    return "event" in event and ("contentBlockDelta" in event["event"] or "contentBlockStart" in event["event"])
+
+
+class RegionRouter:
+    """Ranks the regions serving a model by rolling TTFT and error rate"""
+
+    def __init__(self, models: list[dict], window_seconds: float = ROUTING_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._regions: dict[str, list[str]] = {}
+        # (modelId, region) -> deque of (timestamp, ttft seconds or None on error)
+        self._samples: dict[tuple[str, str], deque] = {}
+
+        for m in models:
+            regions = self._regions.setdefault(m["id"], [])
+            for region in [m["region"], *m.get("regions", [])]:
+                if region not in regions:
+                    regions.append(region)
+
+    def candidate_regions(self, model_id: str, requested_region: str) -> list[str]:
+        regions = [requested_region]
+        for region in self._regions.get(model_id, []):
+            if region not in regions:
+                regions.append(region)
+        return regions
+
+    def _window(self, model_id: str, region: str) -> deque:
+        samples = self._samples.setdefault((model_id, region), deque())
+        expire_before = time.monotonic() - self.window_seconds
+        while samples and samples[0][0] < expire_before:
+            samples.popleft()
+        return samples
+
+    def stats(self, model_id: str, region: str) -> dict:
+        samples = self._window(model_id, region)
+        ttfts = [x for _, x in samples if x is not None]
+        errors = len(samples) - len(ttfts)
+
+        return {
+            "samples": len(samples),
+            "ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+            "errorRate": errors / len(samples) if samples else 0.0,
+        }
+
+    def _score(self, model_id: str, region: str) -> tuple[int, float]:
+        stats = self.stats(model_id, region)
+        unhealthy = stats["samples"] >= ROUTING_MIN_SAMPLES and stats["errorRate"] >= ROUTING_UNHEALTHY_ERROR_RATE
+        ttft = stats["ttft"] if stats["ttft"] is not None else ROUTING_DEFAULT_TTFT_SECONDS
+        return (1 if unhealthy else 0, ttft * (1 + stats["errorRate"]))
+
+    def rank_regions(self, model_id: str, requested_region: str) -> list[str]:
+        """Regions ordered from best to worst. The requested region wins ties."""
+        return sorted(self.candidate_regions(model_id, requested_region), key=lambda region: self._score(model_id, region))
+
+    def record_ttft(self, model_id: str, region: str, ttft: float) -> None:
+        self._window(model_id, region).append((time.monotonic(), ttft))
+
+    def record_error(self, model_id: str, region: str) -> None:
+        self._window(model_id, region).append((time.monotonic(), None))
+
+
+region_router = RegionRouter(PARAMETER["models"])
+
+
+async def route_stream(
+    model_id: str,
+    requested_region: str,
+    open_stream: Callable[[str], AsyncIterator[dict]],
+    on_selected: Callable[[str], None] | None = None,
+    on_abandoned: Callable[[str], None] | None = None,
+    hedge_delay: float = ROUTING_HEDGE_DELAY_SECONDS,
+) -> AsyncIterator[dict]:
+    """Stream agent events from the best region, failing over or hedging before the first token
+
+    Attempts are started in ranked region order. An attempt that fails or gets throttled
+    before its first token makes the next region start immediately, and an attempt still
+    waiting for its first token after hedge_delay seconds is hedged with the next region.
+    The first attempt to produce a token wins and the others are cancelled.
+
+    The attempts share the tools of the request, so only the selected attempt may run them
+    (see AttemptToolGuard). A tool call always follows a first token, so the winner is known by then.
+
+    Args:
+        model_id: Bedrock model ID
+        requested_region: Region selected by the client
+        open_stream: Function that starts the agent stream for a region
+        on_selected: Called with the region of the winning attempt, before its events are yielded
+        on_abandoned: Called with the region of each attempt cancelled for losing (its request is billed all the same)
+        hedge_delay: Seconds to wait for the first token before hedging
+    """
+    remaining_regions = region_router.rank_regions(model_id, requested_region)
+    # region -> (iterator, buffered events, start time)
+    attempts: dict[str, tuple[AsyncIterator[dict], list[dict], float]] = {}
+    pending: dict[asyncio.Task, str] = {}
+    winner = None
+    last_error = None
+
+    def start_next_attempt() -> bool:
+        if not remaining_regions:
+            return False
+        region = remaining_regions.pop(0)
+        stream = open_stream(region)
+        attempts[region] = (stream, [], time.monotonic())
+        pending[asyncio.ensure_future(anext(stream))] = region
+        if len(attempts) > 1:
+            logging.info(f"model={model_id} starting attempt in region={region}")
+        return True
+
+    async def close_attempt(region: str) -> None:
+        with contextlib.suppress(Exception):
+            await attempts.pop(region)[0].aclose()
+
+    try:
+        start_next_attempt()
+        hedge_at = time.monotonic() + hedge_delay
+
+        while winner is None:
+            if not pending:
+                raise last_error if last_error is not None else RuntimeError(f"no region available for model {model_id}")
+
+            done, _ = await asyncio.wait(pending.keys(), timeout=max(0, hedge_at - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                start_next_attempt()
+                hedge_at = time.monotonic() + hedge_delay
+                continue
+
+            for task in done:
+                region = pending.pop(task)
+                stream, buffered, started_at = attempts[region]
+
+                try:
+                    event = task.result()
+                except StopAsyncIteration:
+                    # Finished without any token (e.g. empty response). Nothing to hedge anymore.
+                    winner = region
+                    break
+                except Exception as e:
+                    logging.warning(f"model={model_id} region={region} failed before the first token: {str(e)}")
+                    region_router.record_error(model_id, region)
+                    last_error = e
+                    await close_attempt(region)
+                    if not pending:
+                        start_next_attempt()
+                    continue
+
+                buffered.append(event)
+
+                if is_first_token_event(event):
+                    region_router.record_ttft(model_id, region, time.monotonic() - started_at)
+                    winner = region
+                    break
+
+                if "event_loop_throttled_delay" in event:
+                    # Throttled before the first token: try another region without waiting for the hedge delay
+                    region_router.record_error(model_id, region)
+                    if start_next_attempt():
+                        hedge_at = time.monotonic() + hedge_delay
+
+                pending[asyncio.ensure_future(anext(stream))] = region
+
+        for task, region in list(pending.items()):
+            # No first token: the losing attempt leaves no TTFT sample
+            task.cancel()
+            with contextlib.suppress(BaseException):
+                await task
+            await close_attempt(region)
+            if on_abandoned is not None:
+                on_abandoned(region)
+        pending.clear()
+
+        for region in list(attempts):
+            if region != winner:
+                await close_attempt(region)
+
+        if on_selected is not None:
+            on_selected(winner)
+
+        stream, buffered, _ = attempts[winner]
+
+        for event in buffered:
+            yield event
+
+        try:
+            async for event in stream:
+                yield event
+        except Exception:
+            region_router.record_error(model_id, winner)
+            raise
+    finally:
+        for task in pending:
+            task.cancel()
+        for region in list(attempts):
+            await close_attempt(region)
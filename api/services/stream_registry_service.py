@@ -0,0 +1,400 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
+
+from strands.types.exceptions import ModelThrottledException
+
+from config import STREAM_CANCEL_POLL_SECONDS, STREAM_CHECKPOINT_SECONDS, STREAM_DRAIN_SECONDS, STREAM_FOLLOWER_RENEW_SECONDS, STREAM_LEASE_SECONDS, STREAM_STOP_TIMEOUT_SECONDS
+from database import (
+    create_stream_cancel_request_in_db,
+    delete_stream_cancel_request_in_db,
+    delete_stream_in_db,
+    find_stream_cancel_request_in_db,
+    follow_stream_in_db,
+    get_stream_from_db,
+    get_streams_from_db,
+    renew_stream_lease_in_db,
+    update_stream_in_db,
+)
+from services.chat_service import AttachmentBedrockModel
+from utils import run_to_completion, stream_chunk
+
+
+class StreamStoppedError(Exception):
+    """Raised in the Bedrock reader thread once its stream has been stopped"""
+
+
+class StreamThrottledError(Exception):
+    """Raised instead of ModelThrottledException, which the agent would retry with long backoffs"""
+
+
+# Model making the ConverseStream call of the current thread
+_streaming_model: contextvars.ContextVar["StoppableBedrockModel | None"] = contextvars.ContextVar("streaming_model", default=None)
+
+
+def _keep_response_stream(parsed: dict, **kwargs) -> None:
+    model = _streaming_model.get()
+    if model is not None:
+        model._response_stream = parsed.get("stream")
+
+
+class StoppableBedrockModel(AttachmentBedrockModel):
+    """BedrockModel whose ConverseStream response can be closed from the event loop
+
+    Cancelling the agent only stops the consumer. The thread reading the Bedrock
+    response would keep reading (and Bedrock keep generating billed tokens), so the
+    response is closed as soon as stop_event is set.
+    """
+
+    def __init__(self, stop_event: threading.Event, **model_config):
+        super().__init__(**model_config)
+        self.stop_event = stop_event
+        self._response_stream = None
+        # The client is shared by the models of the region: the handler is registered once (same unique_id)
+        # and hands the response to the model streaming in the calling thread
+        self.client.meta.events.register("after-call.bedrock-runtime.ConverseStream", _keep_response_stream, unique_id="keep-response-stream")
+
+    async def stream(self, *args, **kwargs):
+        # The agent event loop retries a throttled call up to 6 times, backing off for minutes.
+        # Admitted streams fail fast instead: the router tries another region and admission
+        # control lowers the limit of the model.
+        try:
+            async for event in super().stream(*args, **kwargs):
+                yield event
+        except ModelThrottledException as e:
+            raise StreamThrottledError(str(e)) from e
+
+    def _stream(self, callback, *args, **kwargs) -> None:
+        # Runs in its own thread (and context), which makes the ConverseStream call
+        _streaming_model.set(self)
+
+        def stoppable_callback(event=None):
+            if event is not None and self.stop_event.is_set():
+                if self._response_stream is not None:
+                    self._response_stream.close()
+                raise StreamStoppedError()
+            callback(event)
+
+        try:
+            super()._stream(stoppable_callback, *args, **kwargs)
+        except StreamStoppedError:
+            logging.info(f"Closed the Bedrock response stream of model={self.config.get('model_id')}")
+
+
+@dataclass
+class ActiveStream:
+    """A stream generated by this process. Every request for the same assistant message subscribes to it."""
+
+    resource_id: str
+    assistant_message_id: str
+    user_id: str
+    task: asyncio.Task | None = None
+    chunks: list[str] = field(default_factory=list)
+    text: str = ""
+    finished: bool = False
+    # Set once the generation starts (and its messages will be saved). A retry of a stream
+    # that never started (e.g. not admitted) starts over instead of replaying it.
+    replayable: bool = False
+    _changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def publish(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self.text += json.loads(chunk).get("text", "")
+        self._notify()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Yield every chunk from the beginning, then the live ones until the stream finishes
+
+        Chunks published while the subscriber was busy are coalesced into one batch,
+        which the compression middleware sends with a single flush.
+        """
+        index = 0
+
+        while True:
+            if index < len(self.chunks):
+                batch = "".join(self.chunks[index:])
+                index = len(self.chunks)
+                yield batch
+                continue
+
+            if self.finished:
+                return
+
+            await self._changed.wait()
+
+
+# (resource_id of the chat, resource_id of the assistant message) -> stream running in this process
+_active_streams: dict[tuple[str, str], ActiveStream] = {}
+
+# time.monotonic() of the SIGTERM. No new stream is started once the process drains.
+_draining_since: float | None = None
+
+
+def find_active_stream(resource_id: str, assistant_message_id: str) -> ActiveStream | None:
+    return _active_streams.get((resource_id, assistant_message_id))
+
+
+def start_stream(resource_id: str, assistant_message_id: str, user_id: str, produce: Callable[[ActiveStream], AsyncIterator[str]]) -> ActiveStream:
+    """Run a stream in the background of this process
+
+    The generation does not depend on any client connection: a client that drops and
+    retries with the same assistant message subscribes again instead of starting over.
+
+    Args:
+        resource_id: Resource ID of the chat
+        assistant_message_id: Resource ID of the assistant message being generated
+        user_id: User ID
+        produce: Function returning the chunks of the stream
+    """
+    stream = ActiveStream(resource_id=resource_id, assistant_message_id=assistant_message_id, user_id=user_id)
+    _active_streams[(resource_id, assistant_message_id)] = stream
+    stream.task = asyncio.create_task(_run_stream(stream, produce))
+    return stream
+
+
+async def _checkpoint_stream(stream: ActiveStream, interval: float = STREAM_CHECKPOINT_SECONDS) -> None:
+    # Renews the lease with a small update. The text, whose writes cost more as it grows, is only
+    # written while a request of another instance follows the stream (and once when it is done).
+    followed = False
+    written = None
+
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            if followed and stream.text != written:
+                text = stream.text
+                await asyncio.to_thread(update_stream_in_db, stream.resource_id, stream.assistant_message_id, text)
+                written = text
+                # The lease was renewed by the write. Check the followers on the next heartbeat.
+                followed = False
+                continue
+
+            followed_at = await asyncio.to_thread(renew_stream_lease_in_db, stream.resource_id, stream.assistant_message_id)
+            followed = followed_at >= time.time() - STREAM_LEASE_SECONDS
+        except Exception as e:
+            logging.warning(f"Failed to checkpoint stream of chat {stream.resource_id}: {str(e)}")
+
+
+async def _run_stream(stream: ActiveStream, produce: Callable[[ActiveStream], AsyncIterator[str]]) -> None:
+    checkpoint_task = asyncio.create_task(_checkpoint_stream(stream))
+    cancel_watch_task = asyncio.create_task(watch_stream_cancel_requests(stream.resource_id, stream.assistant_message_id))
+
+    try:
+        async for chunk in produce(stream):
+            stream.publish(chunk)
+    except asyncio.CancelledError:
+        # Stopped with cancel_stream. The partial answer has been saved by the producer.
+        pass
+    except Exception as e:
+        logging.error(f"Stream of chat {stream.resource_id} failed: {str(e)}", exc_info=True)
+    finally:
+        _active_streams.pop((stream.resource_id, stream.assistant_message_id), None)
+        checkpoint_task.cancel()
+        cancel_watch_task.cancel()
+
+        # Written before the subscribers finish so that the record is complete once the response ends
+        try:
+            if stream.replayable:
+                await run_to_completion(asyncio.to_thread(update_stream_in_db, stream.resource_id, stream.assistant_message_id, stream.text, "done"))
+            else:
+                await run_to_completion(asyncio.to_thread(delete_stream_in_db, stream.resource_id, stream.assistant_message_id))
+        except Exception as e:
+            logging.error(f"Failed to finish stream record of chat {stream.resource_id}: {str(e)}")
+        finally:
+            stream.finish()
+
+
+async def follow_stream(resource_id: str, assistant_message_id: str, poll_seconds: float = STREAM_CHECKPOINT_SECONDS) -> AsyncIterator[str]:
+    """Stream an assistant message generated by another request from its record in the table
+
+    A finished message is replayed at once. A running one is followed through the
+    checkpoints of the instance generating it, which writes the text while followers are registered.
+
+    Args:
+        resource_id: Resource ID of the chat
+        assistant_message_id: Resource ID of the assistant message
+        poll_seconds: Seconds between reads of the record
+    """
+    sent = 0
+    registered_at = 0.0
+
+    while True:
+        if time.monotonic() - registered_at >= STREAM_FOLLOWER_RENEW_SECONDS:
+            try:
+                # The instance generating the stream only writes its text while it is followed
+                await asyncio.to_thread(follow_stream_in_db, resource_id, assistant_message_id)
+                registered_at = time.monotonic()
+            except Exception as e:
+                logging.warning(f"Failed to register follower of chat {resource_id}: {str(e)}")
+
+        item = await asyncio.to_thread(get_stream_from_db, resource_id, assistant_message_id)
+
+        if item is None or (item["status"] == "running" and int(item["heartbeatAt"]) < time.time() - STREAM_LEASE_SECONDS):
+            # The generating request gave up or its instance went away
+            yield stream_chunk("The response was interrupted. Please try again.")
+            return
+
+        text = item["text"]
+
+        # Empty chunks double as the heartbeat while waiting for checkpoints
+        yield stream_chunk(text[sent:])
+        sent = len(text)
+
+        if item["status"] == "done":
+            return
+
+        await asyncio.sleep(poll_seconds)
+
+
+def _cancel_task(task: asyncio.Task) -> None:
+    # A task already cancelled is saving its partial answer: cancelling it again would interrupt the cleanup
+    if not task.done() and not task.cancelling():
+        task.cancel()
+
+
+def begin_drain() -> None:
+    """Stop accepting new streams. Safe to call from a signal handler."""
+    global _draining_since
+
+    if _draining_since is None:
+        _draining_since = time.monotonic()
+
+
+def is_draining() -> bool:
+    return _draining_since is not None
+
+
+async def drain_streams(timeout: float = STREAM_DRAIN_SECONDS) -> None:
+    """Wait for the streams of this process to finish, then stop the remaining ones
+
+    The timeout counts from begin_drain. Stopped streams save their partial answer and
+    mark their record done, like a cancelled stream, and clean up their workspace and MCP clients.
+    """
+    begin_drain()
+    tasks = [stream.task for stream in _active_streams.values() if stream.task is not None]
+
+    if not tasks:
+        return
+
+    logging.info(f"Draining {len(tasks)} streams")
+    _, pending = await asyncio.wait(tasks, timeout=max(0, timeout - (time.monotonic() - _draining_since)))
+
+    for task in pending:
+        _cancel_task(task)
+
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    if pending:
+        logging.warning(f"Stopped {len(pending)} streams still running after {timeout} seconds")
+
+
+def cancel_stream(resource_id: str, assistant_message_id: str) -> bool:
+    """Cancel a stream running in this process. Returns whether it was found."""
+    stream = _active_streams.get((resource_id, assistant_message_id))
+
+    if stream is None or stream.task is None:
+        return False
+
+    _cancel_task(stream.task)
+    logging.info(f"chat={resource_id} message={assistant_message_id} stream cancelled")
+    return True
+
+
+async def request_stream_cancel(resource_id: str, assistant_message_id: str, x_user_sub: str) -> None:
+    """Stop a stream, wherever it runs
+
+    Streams of this process are cancelled right away. Otherwise the request is left
+    in the table for watch_stream_cancel_requests of the instance serving the stream.
+
+    Args:
+        resource_id: Resource ID of the chat
+        assistant_message_id: Resource ID of the assistant message being generated
+        x_user_sub: User ID
+    """
+    if cancel_stream(resource_id, assistant_message_id):
+        return
+
+    await asyncio.to_thread(create_stream_cancel_request_in_db, resource_id, assistant_message_id, x_user_sub)
+    logging.info(f"chat={resource_id} message={assistant_message_id} stream cancel requested")
+
+
+async def watch_stream_cancel_requests(resource_id: str, assistant_message_id: str, poll_seconds: float = STREAM_CANCEL_POLL_SECONDS) -> None:
+    """Poll the table for a cancel request of a stream of this process and cancel it. Runs until cancelled."""
+    while (resource_id, assistant_message_id) in _active_streams:
+        await asyncio.sleep(poll_seconds)
+
+        try:
+            requested = await asyncio.to_thread(find_stream_cancel_request_in_db, resource_id, assistant_message_id)
+        except Exception as e:
+            logging.warning(f"Failed to check cancel request of chat {resource_id}: {str(e)}")
+            continue
+
+        if requested:
+            cancel_stream(resource_id, assistant_message_id)
+
+            try:
+                await asyncio.to_thread(delete_stream_cancel_request_in_db, resource_id, assistant_message_id)
+            except Exception as e:
+                logging.warning(f"Failed to delete cancel request of chat {resource_id}: {str(e)}")
+            return
+
+
+async def stop_chat_streams(resource_id: str, x_user_sub: str, timeout: float = STREAM_STOP_TIMEOUT_SECONDS) -> bool:
+    """Stop the streams of a chat and wait until they have saved their partial answer
+
+    Called before the chat is deleted: a stream still running would write its messages
+    back into the deleted chat. Streams of this process are cancelled right away, the
+    others are asked to stop and followed through their records.
+
+    Returns whether every stream stopped within the timeout.
+
+    Args:
+        resource_id: Resource ID of the chat
+        x_user_sub: User ID
+        timeout: Seconds to wait for the streams
+    """
+    deadline = time.monotonic() + timeout
+    tasks = [stream.task for stream in list(_active_streams.values()) if stream.resource_id == resource_id and stream.task is not None]
+
+    if tasks:
+        for task in tasks:
+            _cancel_task(task)
+
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+
+        if pending:
+            return False
+
+    requested = set()
+
+    while True:
+        records = await asyncio.to_thread(get_streams_from_db, resource_id)
+        # Running records whose instance stopped renewing them are not served anymore
+        running = [r["orderBy"] for r in records if r["status"] == "running" and int(r["heartbeatAt"]) >= time.time() - STREAM_LEASE_SECONDS]
+
+        if not running:
+            return True
+
+        if time.monotonic() >= deadline:
+            logging.warning(f"chat={resource_id} {len(running)} streams still running after {timeout} seconds")
+            return False
+
+        for assistant_message_id in set(running) - requested:
+            await asyncio.to_thread(create_stream_cancel_request_in_db, resource_id, assistant_message_id, x_user_sub)
+            requested.add(assistant_message_id)
+
+        await asyncio.sleep(STREAM_CANCEL_POLL_SECONDS)
@@ -1,32 +1,52 @@
 import asyncio
+import copy
 import logging
 import os
+import threading
 
-import boto3
-from botocore.config import Config
 from mcp import StdioServerParameters, stdio_client
 from strands import Agent
-from strands.models import BedrockModel
+from strands.tools.executors import ConcurrentToolExecutor, SequentialToolExecutor
 from strands.tools.mcp import MCPClient
-from strands_tools import calculator, current_time, sleep
-from strands_tools.browser import AgentCoreBrowser
-from strands_tools.code_interpreter import AgentCoreCodeInterpreter
-from strands_tools.tavily import tavily_crawl, tavily_extract, tavily_map, tavily_search
-
-from config import PARAMETER, WORKSPACE_DIR
-from database import create_messages_in_db, get_messages_from_db
-from models import MessageInTable, MessageWillBeInTable, StreamingRequest
+
+from config import PARAMETER, TOOL_EXECUTION_CONCURRENT, WORKSPACE_DIR
+from database import add_usage_in_db, create_messages_in_db, get_messages_from_db, index_messages_in_db
+from models import AssistantMessageWillBeInTable, MessageInTableList, StreamingRequest
+from services.admission_service import admission_controller
+from services.attachment_service import prepare_attachments
 from services.chat_service import build_message, build_messages
-from tools import create_session_aware_upload_tool
+from services.model_service import create_model, get_static_tools
+from services.routing_service import is_first_token_event, route_stream
+from services.stream_registry_service import StoppableBedrockModel
+from services.tool_session_service import acquire_tool_sessions, discard_tool_sessions, release_tool_sessions
+from services.usage_service import UsageTracker
+from tools import AttemptToolGuard, ToolExecutionPolicy, cache_tool_results, create_session_aware_upload_tool
 from utils import (
     cleanup_session_workspace,
     create_session_workspace,
     generate_session_id,
     generate_session_system_prompt,
     handle_error_and_stream,
+    is_throttling_error,
+    run_to_completion,
+    stream_cache_hit_chunk,
     stream_chunk,
 )
 
+# Search indexing of the saved answers, which runs after their stream has finished
+_index_tasks: set[asyncio.Task] = set()
+
+
+def _index_messages_later(resource_id: str, x_user_sub: str, messages_in_table: list[dict]) -> None:
+    task = asyncio.create_task(asyncio.to_thread(index_messages_in_db, resource_id, x_user_sub, messages_in_table))
+    _index_tasks.add(task)
+    task.add_done_callback(_index_tasks.discard)
+
+
+async def wait_for_search_indexing() -> None:
+    """Wait for the search indexing of the answers saved by the finished streams (on shutdown)"""
+    await asyncio.gather(*_index_tasks, return_exceptions=True)
+
 
 async def process_streaming_request(request: StreamingRequest, x_user_sub: str, chat_exists: bool):
     """Process streaming request and yield chunks"""
@@ -43,10 +63,13 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
     if chat_exists:
         logging.info(f"chat={request.resourceId} found. retrieve prev messages.")
         prev_messages_data = get_messages_from_db(request.resourceId)
-        prev_messages = [MessageInTable(**x) for x in prev_messages_data]
+        prev_messages = MessageInTableList.validate_python(prev_messages_data)
 
     # Initialize text accumulation for assistant response
     accumulated_text = ""
+    tool_sessions = None
+    mcp_clients = []
+    usage_tracker = UsageTracker(request.modelId)
 
     heartbeat_queue = asyncio.Queue()
     stream_finished = asyncio.Event()
@@ -61,47 +84,16 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
             pass
 
     async def stream_task():
-        nonlocal accumulated_text
+        nonlocal accumulated_text, tool_sessions
         try:
-            session = boto3.Session(
-                region_name=request.modelRegion,
-            )
-
-            model_params = {
-                "model_id": request.modelId,
-                "boto_session": session,
-                "max_tokens": 4096,
-                "boto_client_config": Config(
-                    retries={
-                        "max_attempts": 10,
-                        "mode": "standard",
-                    },
-                    connect_timeout=10,
-                    read_timeout=300,
-                ),
-            }
-
             # Extract tools from user message
             user_tools = request.userMessage.tools or []
 
-            if "reasoning" in user_tools:
-                model_params["additional_request_fields"] = {
-                    "thinking": {
-                        "type": "enabled",
-                        "budget_tokens": 1024,
-                    },
-                }
-
             # Create session-aware upload tool
             session_upload_tool = create_session_aware_upload_tool(session_workspace_dir, x_user_sub)
 
-            model = BedrockModel(**model_params)
-            tools = [
-                current_time,
-                calculator,
-                sleep,
-                session_upload_tool,
-            ]
+            # Only the upload tool is bound to the session: the other tools without a session are built once
+            tools = [*get_static_tools("webSearch" in user_tools), session_upload_tool]
 
             if "imageGeneration" in user_tools:
                 image_generation_mcp_client = MCPClient(
@@ -122,6 +114,7 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
                     )
                 )
                 image_generation_mcp_client.start()
+                mcp_clients.append(image_generation_mcp_client)
                 image_generation_tools = image_generation_mcp_client.list_tools_sync()
                 tools = tools + image_generation_tools
 
@@ -141,33 +134,90 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
                     )
                 )
                 aws_documentation_mcp_client.start()
+                mcp_clients.append(aws_documentation_mcp_client)
                 aws_documentation_tools = aws_documentation_mcp_client.list_tools_sync()
-                tools = tools + aws_documentation_tools
+                tools = tools + cache_tool_results(aws_documentation_tools)
+
+            system_prompt = session_system_prompt
+            # Tools running on the AgentCore sessions of the chat
+            session_tool_names = set()
+
+            def on_tool_timeout(tool_name: str) -> None:
+                # The call keeps running in its thread: the next turn must not reuse its busy session
+                if tool_name in session_tool_names:
+                    discard_tool_sessions(tool_sessions)
+
+            use_code_interpreter = "codeInterpreter" in user_tools
+            use_browser = "webBrowser" in user_tools
+
+            if use_code_interpreter or use_browser:
+                # Reuse the sandbox and browser sessions kept warm from previous turns of this chat
+                tool_sessions = await acquire_tool_sessions(request.resourceId, x_user_sub, use_code_interpreter, use_browser)
+                system_prompt += tool_sessions.describe(use_code_interpreter, use_browser)
+
+                if use_code_interpreter:
+                    tools.append(tool_sessions.code_interpreter.code_interpreter)
+                    session_tool_names.add(tool_sessions.code_interpreter.code_interpreter.tool_name)
+
+                if use_browser:
+                    tools.append(tool_sessions.browser.browser)
+                    session_tool_names.add(tool_sessions.browser.browser.tool_name)
+
+            # Downscaled images and extracted text are created once and saved with the messages
+            await prepare_attachments([*prev_messages, request.userMessage])
+
+            # Built once and shared by every region attempt. Attachments stay in S3 (see AttachmentBedrockModel).
+            messages = build_messages(prev_messages)
+            user_content = build_message(request.userMessage)["content"]
+
+            selected_region = None
+            # Regions that throttled: admission control is adjusted for the region that was actually called
+            throttled_regions = set()
+
+            def select_region(region: str) -> None:
+                nonlocal selected_region
+                selected_region = region
+                usage_tracker.select_region(region)
+
+            async def open_agent_stream(region: str):
+                # Set when the attempt is closed (cancelled, lost the hedge or finished) to stop reading from Bedrock
+                stop_event = threading.Event()
+                model = create_model(StoppableBedrockModel, request.modelId, region, reasoning="reasoning" in user_tools, stop_event=stop_event)
+                agent = Agent(
+                    system_prompt=system_prompt,
+                    model=model,
+                    tools=tools,
+                    messages=copy.deepcopy(messages),
+                    tool_executor=ConcurrentToolExecutor() if TOOL_EXECUTION_CONCURRENT else SequentialToolExecutor(),
+                    hooks=[AttemptToolGuard(lambda: selected_region == region), ToolExecutionPolicy(on_timeout=on_tool_timeout)],
+                )
 
-            if "webSearch" in user_tools:
-                tools.append(tavily_search)
-                tools.append(tavily_extract)
-                tools.append(tavily_crawl)
-                tools.append(tavily_map)
+                try:
+                    # A throttled call raises StreamThrottledError at once (see StoppableBedrockModel)
+                    async for event in agent.stream_async(copy.deepcopy(user_content)):
+                        yield event
+                except Exception as e:
+                    if is_throttling_error(e):
+                        throttled_regions.add(region)
+                        admission_controller.record_throttle((request.modelId, region))
+                    raise
+                finally:
+                    stop_event.set()
 
-            if "codeInterpreter" in user_tools:
-                agent_core_code_interpreter = AgentCoreCodeInterpreter(region=PARAMETER["agentCoreRegion"])
-                tools.append(agent_core_code_interpreter.code_interpreter)
+            reasoning_block = False
 
-            if "webBrowser" in user_tools:
-                agent_core_browser = AgentCoreBrowser(region=PARAMETER["agentCoreRegion"])
-                tools.append(agent_core_browser.browser)
+            async for event in route_stream(request.modelId, request.modelRegion, open_agent_stream, on_selected=select_region, on_abandoned=usage_tracker.record_abandoned_attempt):
+                if is_first_token_event(event):
+                    usage_tracker.record_first_token()
 
-            agent = Agent(
-                system_prompt=session_system_prompt,
-                model=model,
-                tools=tools,
-                messages=build_messages(prev_messages),
-            )
+                # Token usage and latency of a model call
+                if "event" in event and "metadata" in event["event"]:
+                    usage_tracker.record_metadata(event["event"]["metadata"])
 
-            reasoning_block = False
+                # Tool result served from the cache
+                if "tool_stream_event" in event and isinstance(event["tool_stream_event"].get("data"), dict) and "cacheHit" in event["tool_stream_event"]["data"]:
+                    await heartbeat_queue.put(stream_cache_hit_chunk(event["tool_stream_event"]["data"]["cacheHit"]))
 
-            async for event in agent.stream_async(build_message(request.userMessage)["content"]):
                 # Text output
                 if "event" in event and "contentBlockDelta" in event["event"] and "delta" in event["event"]["contentBlockDelta"] and "text" in event["event"]["contentBlockDelta"]["delta"]:
                     text_chunk = event["event"]["contentBlockDelta"]["delta"]["text"]
@@ -209,7 +259,11 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
                     tool_end = "\n```\n"
                     accumulated_text += tool_end
                     await heartbeat_queue.put(stream_chunk(tool_end))
+
+            if selected_region is not None and selected_region not in throttled_regions:
+                admission_controller.record_success((request.modelId, selected_region))
         except Exception as e:
+            # Throttling errors were recorded by the attempt that got them
             logging.error(f"Streaming error: {str(e)}", exc_info=True)
             await heartbeat_queue.put(handle_error_and_stream(e))
         finally:
@@ -228,35 +282,69 @@ async def process_streaming_request(request: StreamingRequest, x_user_sub: str,
     finally:
         heartbeat_task_handle.cancel()
         stream_task_handle.cancel()
-        try:
-            await heartbeat_task_handle
-        except asyncio.CancelledError:
-            pass
-        try:
-            await stream_task_handle
-        except asyncio.CancelledError:
-            pass
-
-        # Save messages to database after streaming completes
-        try:
-            # Use tools directly from user message
-            user_message = request.userMessage
-
-            # Build assistant message from accumulated text (assistant messages have tools=None)
-            assistant_message = MessageWillBeInTable(role="assistant", content=[{"text": accumulated_text}] if accumulated_text else [{"text": ""}], resourceId=request.assistantMessage.resourceId, tools=None)
 
-            # Save both messages to database
-            messages_to_save = [user_message, assistant_message]
-            create_messages_in_db(request.resourceId, x_user_sub, messages_to_save)
-            logging.info(f"Successfully saved {len(messages_to_save)} messages for chat {request.resourceId}")
+        async def finish_request():
+            try:
+                await heartbeat_task_handle
+            except asyncio.CancelledError:
+                pass
+            try:
+                await stream_task_handle
+            except asyncio.CancelledError:
+                pass
 
-        except Exception as e:
-            # Log error but don't interrupt streaming response
-            logging.error(f"Failed to save messages for chat {request.resourceId}: {str(e)}", exc_info=True)
+            usage_tracker.finish()
 
-        # Clean up session workspace
-        try:
-            cleanup_session_workspace(session_id, WORKSPACE_DIR)
-            logging.info(f"Cleaned up session workspace: {session_workspace_dir}")
-        except Exception as e:
-            logging.error(f"Failed to clean up session workspace {session_workspace_dir}: {str(e)}")
+            # Save messages to database after streaming completes (the partial answer when cancelled)
+            try:
+                # Use tools directly from user message
+                user_message = request.userMessage
+
+                # Build assistant message from accumulated text (assistant messages have tools=None)
+                assistant_message = AssistantMessageWillBeInTable(role="assistant", content=[{"text": accumulated_text}] if accumulated_text else [{"text": ""}], resourceId=request.assistantMessage.resourceId, tools=None, usage=usage_tracker.to_item())
+
+                # Save both messages to database
+                messages_to_save = [user_message, assistant_message]
+                # Kept off the event loop, which serves the other streams
+                messages_in_table = await asyncio.to_thread(create_messages_in_db, request.resourceId, x_user_sub, messages_to_save, index=False)
+                logging.info(f"Successfully saved {len(messages_to_save)} messages for chat {request.resourceId}")
+
+                # Up to 200 postings per message and the document counter of the user: written in the
+                # background, so that the stream (and a stop or delete waiting for it) ends once the messages are saved
+                _index_messages_later(request.resourceId, x_user_sub, messages_in_table)
+
+            except Exception as e:
+                # Log error but don't interrupt streaming response
+                logging.error(f"Failed to save messages for chat {request.resourceId}: {str(e)}", exc_info=True)
+
+            # Add the usage of each region to the daily counters read by GET /api/usage
+            for region, counters in usage_tracker.region_counters.items():
+                try:
+                    await asyncio.to_thread(add_usage_in_db, x_user_sub, request.modelId, region, counters)
+                except Exception as e:
+                    logging.error(f"Failed to record usage in {region} for chat {request.resourceId}: {str(e)}")
+
+            # Stop the MCP server processes started for this request
+            for mcp_client in mcp_clients:
+                try:
+                    await asyncio.to_thread(mcp_client.stop, None, None, None)
+                except Exception as e:
+                    logging.error(f"Failed to stop MCP client for chat {request.resourceId}: {str(e)}")
+
+            # Return the AgentCore tool sessions to the pool for the next turn
+            if tool_sessions is not None:
+                try:
+                    await release_tool_sessions(tool_sessions)
+                except Exception as e:
+                    logging.error(f"Failed to release tool sessions for chat {request.resourceId}: {str(e)}")
+
+            # Clean up session workspace
+            try:
+                cleanup_session_workspace(session_id, WORKSPACE_DIR)
+                logging.info(f"Cleaned up session workspace: {session_workspace_dir}")
+            except Exception as e:
+                logging.error(f"Failed to clean up session workspace {session_workspace_dir}: {str(e)}")
+
+        # Stopping the stream again (another stop click, a drain or a delete) must not skip the cleanup:
+        # the answer, the usage, the MCP processes and the pooled sessions would be left behind
+        await run_to_completion(finish_request())
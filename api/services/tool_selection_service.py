@@ -1,11 +1,10 @@
 import json
 import logging
 
-import boto3
 from strands import Agent
-from strands.models import BedrockModel
 
 from config import PARAMETER
+from services.model_service import get_model
 
 
 def select_tools_for_prompt(prompt: str) -> dict:
@@ -19,16 +18,7 @@ def select_tools_for_prompt(prompt: str) -> dict:
         Dictionary with tool selection results
     """
     try:
-        session = boto3.Session(
-            region_name=PARAMETER["createTitleModel"]["region"],
-        )
-
-        model_params = {
-            "model_id": PARAMETER["createTitleModel"]["id"],
-            "boto_session": session,
-        }
-
-        model = BedrockModel(**model_params)
+        model = get_model(PARAMETER["createTitleModel"]["id"], PARAMETER["createTitleModel"]["region"])
         agent = Agent(model=model)
 
         tool_descriptions = {
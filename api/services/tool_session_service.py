@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from strands_tools.browser import AgentCoreBrowser
+from strands_tools.code_interpreter import AgentCoreCodeInterpreter
+
+from config import PARAMETER, TOOL_SESSION_IDLE_TTL_SECONDS, TOOL_SESSION_POOL_MAX_SIZE
+
+
+@dataclass
+class ToolSessions:
+    """AgentCore tool instances of a chat. Each instance keeps its sandbox/browser sessions."""
+
+    resource_id: str
+    user_id: str
+    code_interpreter: AgentCoreCodeInterpreter | None = None
+    browser: AgentCoreBrowser | None = None
+    pooled: bool = True
+    in_use: bool = False
+    last_used: float = field(default_factory=time.monotonic)
+
+    def describe(self, code_interpreter: bool, browser: bool) -> str:
+        """Describe the sessions left running by previous turns, for the system prompt"""
+        lines = []
+
+        if code_interpreter and self.code_interpreter is not None and self.code_interpreter._sessions:
+            lines.append(f"- Code interpreter sessions: {', '.join(self.code_interpreter._sessions.keys())}")
+
+        if browser and self.browser is not None and self.browser._sessions:
+            lines.append(f"- Browser sessions: {', '.join(self.browser._sessions.keys())}")
+
+        if not lines:
+            return ""
+
+        return "\n## Running Sessions\nThe following sessions were started in previous turns of this conversation and are still running. Variables, installed packages and open pages are kept. Reuse them instead of initializing new sessions.\n" + "\n".join(lines) + "\n"
+
+
+# (user ID, resource_id of the chat) -> sessions, least recently used first. Keyed by the user too,
+# so that the sandbox files and browser state of a chat are never handed to another user's request.
+_pool: OrderedDict[tuple[str, str], ToolSessions] = OrderedDict()
+
+
+def _close_sessions_sync(sessions: ToolSessions) -> None:
+    # The browser drives its own event loop, so this must not run on the server's event loop thread
+    if sessions.code_interpreter is not None:
+        try:
+            sessions.code_interpreter._cleanup()
+        except Exception as e:
+            logging.warning(f"Failed to clean up code interpreter of chat {sessions.resource_id}: {str(e)}")
+
+    if sessions.browser is not None:
+        try:
+            sessions.browser._cleanup()
+        except Exception as e:
+            logging.warning(f"Failed to clean up browser of chat {sessions.resource_id}: {str(e)}")
+
+
+async def _close_sessions(sessions: ToolSessions) -> None:
+    await asyncio.to_thread(_close_sessions_sync, sessions)
+    logging.info(f"Closed tool sessions of chat {sessions.resource_id}")
+
+
+def _pop_evictable() -> list[ToolSessions]:
+    now = time.monotonic()
+    evicted = []
+
+    for key, sessions in list(_pool.items()):
+        if not sessions.in_use and now - sessions.last_used > TOOL_SESSION_IDLE_TTL_SECONDS:
+            evicted.append(_pool.pop(key))
+
+    for key, sessions in list(_pool.items()):
+        if len(_pool) < TOOL_SESSION_POOL_MAX_SIZE:
+            break
+        if not sessions.in_use:
+            evicted.append(_pool.pop(key))
+
+    return evicted
+
+
+async def acquire_tool_sessions(resource_id: str, x_user_sub: str, code_interpreter: bool, browser: bool) -> ToolSessions:
+    """Get the warm AgentCore tool instances of a chat, creating the missing ones
+
+    Args:
+        resource_id: Resource ID of the chat
+        x_user_sub: User ID
+        code_interpreter: Whether the code interpreter is needed in this turn
+        browser: Whether the browser is needed in this turn
+    """
+    for sessions in _pop_evictable():
+        await _close_sessions(sessions)
+
+    key = (x_user_sub, resource_id)
+    sessions = _pool.get(key)
+
+    if sessions is None or sessions.in_use:
+        # A concurrent turn of the same chat gets its own short-lived instances
+        pooled = sessions is None and len(_pool) < TOOL_SESSION_POOL_MAX_SIZE
+        sessions = ToolSessions(resource_id=resource_id, user_id=x_user_sub, pooled=pooled)
+
+        if pooled:
+            _pool[key] = sessions
+    else:
+        _pool.move_to_end(key)
+
+    sessions.in_use = True
+
+    if code_interpreter and sessions.code_interpreter is None:
+        sessions.code_interpreter = AgentCoreCodeInterpreter(region=PARAMETER["agentCoreRegion"])
+
+    if browser and sessions.browser is None:
+        sessions.browser = await asyncio.to_thread(AgentCoreBrowser, region=PARAMETER["agentCoreRegion"])
+
+    return sessions
+
+
+async def release_tool_sessions(sessions: ToolSessions) -> None:
+    """Return the tool instances after a turn. Unpooled instances are closed right away."""
+    sessions.in_use = False
+    sessions.last_used = time.monotonic()
+
+    if not sessions.pooled:
+        await _close_sessions(sessions)
+
+
+def discard_tool_sessions(sessions: ToolSessions) -> None:
+    """Take in-use tool instances out of the pool, e.g. when a tool call timed out but keeps running on them
+
+    The next turn of the chat gets new instances, and release_tool_sessions closes these ones
+    (which stops the running call) at the end of the turn.
+    """
+    key = (sessions.user_id, sessions.resource_id)
+
+    if _pool.get(key) is sessions:
+        del _pool[key]
+
+    if sessions.pooled:
+        logging.info(f"Discarded tool sessions of chat {sessions.resource_id}")
+
+    sessions.pooled = False
+
+
+async def close_tool_sessions(resource_id: str, x_user_sub: str) -> None:
+    """Tear down the tool sessions of a chat"""
+    sessions = _pool.pop((x_user_sub, resource_id), None)
+
+    if sessions is None:
+        return
+
+    if sessions.in_use:
+        # Closed by release_tool_sessions once the running turn finishes
+        sessions.pooled = False
+    else:
+        await _close_sessions(sessions)
+
+
+async def close_all_tool_sessions() -> None:
+    """Tear down every pooled tool session (e.g. on shutdown)"""
+    while _pool:
+        _, sessions = _pool.popitem()
+        await _close_sessions(sessions)
@@ -0,0 +1,120 @@
+import time
+
+# Counters summed over every model call of an answer and kept per user, day and model
+USAGE_COUNTERS = ("inputTokens", "outputTokens", "totalTokens", "cacheReadInputTokens", "cacheWriteInputTokens", "latencyMs", "modelCalls", "messages")
+
+
+class UsageTracker:
+    """Collects token usage and timing of one streamed answer from the agent events
+
+    Usage is kept per region. The answer is streamed from the region selected by the router,
+    and each attempt that lost a hedge is billed in its own region for the input tokens of the
+    request it had sent. Bedrock does not report them for a cancelled stream: they are taken
+    from the first model call of the answer, which sent the same request.
+    """
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.model_region: str | None = None
+        # region -> counters
+        self.region_counters: dict[str, dict[str, int]] = {}
+        self.started_at = time.monotonic()
+        self.ttft_ms: int | None = None
+        self._abandoned_regions: list[str] = []
+        self._first_call_usage: dict | None = None
+
+    def _counters(self, region: str) -> dict[str, int]:
+        return self.region_counters.setdefault(region, dict.fromkeys(USAGE_COUNTERS, 0))
+
+    def select_region(self, region: str) -> None:
+        """Set the region the answer is streamed from"""
+        self.model_region = region
+        self._counters(region)["messages"] = 1
+
+    def record_abandoned_attempt(self, region: str) -> None:
+        """Record an attempt cancelled before its first token"""
+        self._abandoned_regions.append(region)
+
+    def record_first_token(self) -> None:
+        if self.ttft_ms is None:
+            self.ttft_ms = int((time.monotonic() - self.started_at) * 1000)
+
+    def record_metadata(self, metadata: dict) -> None:
+        """Add the metadata event sent by Bedrock at the end of each model call of the selected region"""
+        usage = metadata.get("usage", {})
+        counters = self._counters(self.model_region)
+
+        if self._first_call_usage is None:
+            self._first_call_usage = usage
+
+        for key in ("inputTokens", "outputTokens", "totalTokens", "cacheReadInputTokens", "cacheWriteInputTokens"):
+            counters[key] += int(usage.get(key, 0))
+
+        counters["latencyMs"] += int(metadata.get("metrics", {}).get("latencyMs", 0))
+        counters["modelCalls"] += 1
+
+    def finish(self) -> None:
+        """Add the input tokens of the abandoned attempts, once the first model call has reported its usage"""
+        if self._first_call_usage is not None:
+            # The prompt cache of the selected region does not apply to the others
+            input_tokens = sum(int(self._first_call_usage.get(key, 0)) for key in ("inputTokens", "cacheReadInputTokens", "cacheWriteInputTokens"))
+
+            for region in self._abandoned_regions:
+                counters = self._counters(region)
+                counters["inputTokens"] += input_tokens
+                counters["totalTokens"] += input_tokens
+                counters["modelCalls"] += 1
+
+        self._abandoned_regions.clear()
+
+    @property
+    def counters(self) -> dict[str, int]:
+        """Counters summed over every region"""
+        total = dict.fromkeys(USAGE_COUNTERS, 0)
+
+        for counters in self.region_counters.values():
+            for key, value in counters.items():
+                total[key] += value
+
+        return total
+
+    def to_item(self) -> dict:
+        """Usage stored on the assistant message (every attempt, with the region the answer was streamed from)"""
+        item = {
+            "modelId": self.model_id,
+            "durationMs": int((time.monotonic() - self.started_at) * 1000),
+            **{k: v for k, v in self.counters.items() if k != "messages"},
+        }
+
+        if self.model_region is not None:
+            item["modelRegion"] = self.model_region
+
+        if self.ttft_ms is not None:
+            item["ttftMs"] = self.ttft_ms
+
+        return item
+
+
+def summarize_usage(items: list[dict]) -> dict:
+    """Sum the daily usage counters into totals, per-model totals and per-region totals"""
+    total = dict.fromkeys(USAGE_COUNTERS, 0)
+    models = {}
+    regions = {}
+
+    for item in items:
+        model_total = models.setdefault(item["modelId"], dict.fromkeys(USAGE_COUNTERS, 0))
+        # Counters recorded before they were kept per region have no region
+        region_total = regions.setdefault(item["modelRegion"], dict.fromkeys(USAGE_COUNTERS, 0)) if "modelRegion" in item else None
+
+        for key in USAGE_COUNTERS:
+            value = int(item.get(key, 0))
+            total[key] += value
+            model_total[key] += value
+            if region_total is not None:
+                region_total[key] += value
+
+    return {
+        "total": total,
+        "models": models,
+        "regions": regions,
+    }
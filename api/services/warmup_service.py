@@ -0,0 +1,93 @@
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from strands import Agent
+
+from aws import get_boto_session
+from config import BUCKET, MODEL_MAX_TOKENS, PARAMETER, WARMUP_MIN_INTERVAL_SECONDS
+from database import get_dynamodb_client, get_dynamodb_table
+from s3 import get_s3_client
+from services.model_service import get_bedrock_client, get_model, get_model_config, get_static_tools
+
+_last_warm_up: float | None = None
+_last_warm_up_lock = threading.Lock()
+
+
+def _model_regions() -> set[tuple[str, str]]:
+    models = {(PARAMETER["createTitleModel"]["id"], PARAMETER["createTitleModel"]["region"])}
+
+    for m in PARAMETER["models"]:
+        models.update((m["id"], region) for region in [m["region"], *m.get("regions", [])])
+
+    return models
+
+
+def _resolve_credentials() -> None:
+    get_boto_session().get_credentials().get_frozen_credentials()
+
+
+def _open_dynamodb() -> None:
+    get_dynamodb_client()
+    # Any request opens a connection of the pool. The item does not exist.
+    get_dynamodb_table().get_item(Key={"queryId": "warmup", "orderBy": "warmup"})
+
+
+def _open_s3() -> None:
+    try:
+        get_s3_client().head_object(Bucket=BUCKET, Key="warmup")
+    except ClientError:
+        # Not found: the connection is open all the same
+        pass
+
+
+@functools.cache
+def _preload_models() -> None:
+    # Creates the Bedrock clients and model configs, which model_service keeps for the requests,
+    # and loads the strands modules an agent needs
+    for model_id, region in sorted(_model_regions()):
+        get_bedrock_client(region)
+        get_model_config(model_id, False, MODEL_MAX_TOKENS)
+
+    model = get_model(PARAMETER["createTitleModel"]["id"], PARAMETER["createTitleModel"]["region"])
+    Agent(model=model, tools=list(get_static_tools(False)), callback_handler=None)
+
+
+def warm_up() -> None:
+    """Create what the first request would otherwise have to create
+
+    Resolves the credentials, opens the connections to DynamoDB and S3, and creates the Bedrock
+    clients and configs of the models of PARAMETER and the static tools. Models and tools are
+    created once, DynamoDB and S3 are called every time (a warm-up ping also keeps their
+    connections open). Failures are logged: requests create what is missing.
+    """
+    started = time.monotonic()
+    _resolve_credentials()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {name: executor.submit(step) for name, step in (("dynamodb", _open_dynamodb), ("s3", _open_s3), ("models", _preload_models))}
+
+    for name, future in futures.items():
+        if future.exception() is not None:
+            logging.warning(f"Warm-up of {name} failed: {str(future.exception())}")
+
+    logging.info(f"Warmed up in {time.monotonic() - started:.2f} seconds")
+
+
+def warm_up_if_due(min_interval: float = WARMUP_MIN_INTERVAL_SECONDS) -> bool:
+    """Run warm_up unless it started less than min_interval seconds ago. Returns whether it ran."""
+    global _last_warm_up
+
+    with _last_warm_up_lock:
+        now = time.monotonic()
+
+        if _last_warm_up is not None and now - _last_warm_up < min_interval:
+            return False
+
+        _last_warm_up = now
+
+    warm_up()
+    return True
@@ -1,9 +1,29 @@
+import asyncio
+import json
+import logging
+from collections.abc import Callable
 from contextvars import ContextVar
+from typing import Any
 
 from strands import tool
+from strands.hooks import AfterToolCallEvent, BeforeToolCallEvent, HookProvider, HookRegistry
+from strands.types._events import ToolResultEvent
+from strands.types.tools import AgentTool, ToolGenerator, ToolSpec, ToolUse
+from strands_tools import calculator, current_time, sleep
 
+from cache import tool_cache_key, tool_result_cache
+from config import (
+    TOOL_RESULT_CACHE_TTL_SECONDS,
+    TOOL_RESULT_DEFAULT_MAX_CHARS,
+    TOOL_RESULT_MAX_CHARS,
+    TOOL_TIMEOUT_DEFAULT_SECONDS,
+    TOOL_TIMEOUT_SECONDS,
+)
 from s3 import upload_file_to_s3
 
+# Tools of every chat, besides the upload tool bound to the session workspace
+BASE_TOOLS = [current_time, calculator, sleep]
+
 # Context variable to store session workspace directory
 session_workspace_context: ContextVar[str] = ContextVar("session_workspace_context", default=None)
 
@@ -24,3 +44,200 @@ def create_session_aware_upload_tool(session_workspace_dir: str, x_user_sub: str
         return upload_file_to_s3(filepath, session_workspace_dir, effective_user_sub)
 
     return upload_file_to_s3_and_retrieve_s3_url
+
+
+class CachedTool(AgentTool):
+    """Wrap a tool so that identical calls within the TTL are answered from the cache"""
+
+    def __init__(self, tool: AgentTool, ttl: float):
+        super().__init__()
+        self._tool = tool
+        self._ttl = ttl
+
+    @property
+    def tool_name(self) -> str:
+        return self._tool.tool_name
+
+    @property
+    def tool_spec(self) -> ToolSpec:
+        return self._tool.tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self._tool.tool_type
+
+    async def stream(self, tool_use: ToolUse, invocation_state: dict[str, Any], **kwargs: Any) -> ToolGenerator:
+        key = tool_cache_key(self.tool_name, tool_use.get("input", {}))
+        content = tool_result_cache.get(key)
+
+        if content is not None:
+            logging.info(f"Tool result cache hit: {self.tool_name}")
+            # Surfaced by the agent as a tool_stream_event so that the stream can annotate the hit
+            yield {"cacheHit": self.tool_name}
+            yield ToolResultEvent({"toolUseId": tool_use["toolUseId"], "status": "success", "content": content})
+            return
+
+        async for event in self._tool.stream(tool_use, invocation_state, **kwargs):
+            if isinstance(event, ToolResultEvent) and event.tool_result.get("status") == "success":
+                tool_result_cache.put(key, event.tool_result["content"], self._ttl)
+            yield event
+
+
+def cache_tool_results(tools: list) -> list:
+    """Wrap the tools that have a TTL in TOOL_RESULT_CACHE_TTL_SECONDS with CachedTool"""
+    wrapped = []
+
+    for t in tools:
+        ttl = TOOL_RESULT_CACHE_TTL_SECONDS.get(t.tool_name) if isinstance(t, AgentTool) else None
+        wrapped.append(CachedTool(t, ttl) if ttl else t)
+
+    return wrapped
+
+
+class TimeoutTool(AgentTool):
+    """Wrap a tool so that it returns an error result when it runs longer than the timeout
+
+    Only async tools are stopped: a sync tool keeps running in its thread, so on_timeout is
+    called with the tool name to keep its session from being reused.
+    """
+
+    def __init__(self, tool: AgentTool, timeout: float, on_timeout: Callable[[str], None] | None = None):
+        super().__init__()
+        self._tool = tool
+        self._timeout = timeout
+        self._on_timeout = on_timeout
+
+    @property
+    def tool_name(self) -> str:
+        return self._tool.tool_name
+
+    @property
+    def tool_spec(self) -> ToolSpec:
+        return self._tool.tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self._tool.tool_type
+
+    async def stream(self, tool_use: ToolUse, invocation_state: dict[str, Any], **kwargs: Any) -> ToolGenerator:
+        try:
+            async with asyncio.timeout(self._timeout):
+                async for event in self._tool.stream(tool_use, invocation_state, **kwargs):
+                    yield event
+        except TimeoutError:
+            logging.warning(f"Tool {self.tool_name} timed out after {self._timeout} seconds")
+
+            if self._on_timeout is not None:
+                self._on_timeout(self.tool_name)
+
+            yield ToolResultEvent(
+                {
+                    "toolUseId": tool_use["toolUseId"],
+                    "status": "error",
+                    "content": [{"text": f"The tool {self.tool_name} did not finish within {self._timeout} seconds. Its result was abandoned, but the call may still be running in the background: do not assume it had no effect."}],
+                }
+            )
+
+
+def truncate_tool_result_content(content: list, max_chars: int) -> list:
+    """Cap the text and JSON blocks of a tool result to max_chars in total. Other blocks (e.g. images) are kept."""
+    truncated = []
+    remaining = max_chars
+
+    for block in content:
+        if "text" in block:
+            text = block["text"]
+        elif "json" in block:
+            text = json.dumps(block["json"], ensure_ascii=False, default=str)
+        else:
+            truncated.append(block)
+            continue
+
+        if len(text) <= remaining:
+            truncated.append(block)
+            remaining -= len(text)
+        else:
+            truncated.append({"text": text[:remaining] + f"\n... [truncated {len(text) - remaining} characters]"})
+            remaining = 0
+
+    return truncated
+
+
+class ToolExecutionPolicy(HookProvider):
+    """Per-tool timeouts and result-size caps for the streaming agent
+
+    Args:
+        on_timeout: Called with the name of a tool that timed out (see TimeoutTool)
+    """
+
+    def __init__(self, on_timeout: Callable[[str], None] | None = None):
+        self.on_timeout = on_timeout
+
+    def register_hooks(self, registry: HookRegistry, **kwargs: Any) -> None:
+        registry.add_callback(BeforeToolCallEvent, self.apply_timeout)
+        registry.add_callback(AfterToolCallEvent, self.cap_result)
+
+    def apply_timeout(self, event: BeforeToolCallEvent) -> None:
+        if event.selected_tool is None:
+            return
+
+        timeout = TOOL_TIMEOUT_SECONDS.get(event.selected_tool.tool_name, TOOL_TIMEOUT_DEFAULT_SECONDS)
+        event.selected_tool = TimeoutTool(event.selected_tool, timeout, self.on_timeout)
+
+    def cap_result(self, event: AfterToolCallEvent) -> None:
+        tool_name = event.tool_use["name"]
+        max_chars = TOOL_RESULT_MAX_CHARS.get(tool_name, TOOL_RESULT_DEFAULT_MAX_CHARS)
+        content = event.result.get("content", [])
+        capped = truncate_tool_result_content(content, max_chars)
+
+        if capped != content:
+            logging.info(f"Truncated result of tool {tool_name} to {max_chars} characters")
+            event.result = {**event.result, "content": capped}
+
+
+class NotSelectedTool(AgentTool):
+    """Stands in for a tool called by a routing attempt that was not selected: returns an error result without running it"""
+
+    def __init__(self, tool: AgentTool):
+        super().__init__()
+        self._tool = tool
+
+    @property
+    def tool_name(self) -> str:
+        return self._tool.tool_name
+
+    @property
+    def tool_spec(self) -> ToolSpec:
+        return self._tool.tool_spec
+
+    @property
+    def tool_type(self) -> str:
+        return self._tool.tool_type
+
+    async def stream(self, tool_use: ToolUse, invocation_state: dict[str, Any], **kwargs: Any) -> ToolGenerator:
+        logging.warning(f"Tool {self.tool_name} was not run: its attempt was not selected")
+        yield ToolResultEvent(
+            {
+                "toolUseId": tool_use["toolUseId"],
+                "status": "error",
+                "content": [{"text": f"The tool {self.tool_name} was not run."}],
+            }
+        )
+
+
+class AttemptToolGuard(HookProvider):
+    """Only let the attempt selected by route_stream run tools
+
+    Hedged attempts share the tools of the request (AgentCore sessions, MCP clients), so a
+    side-effecting tool must never run twice on them.
+    """
+
+    def __init__(self, is_selected: Callable[[], bool]):
+        self.is_selected = is_selected
+
+    def register_hooks(self, registry: HookRegistry, **kwargs: Any) -> None:
+        registry.add_callback(BeforeToolCallEvent, self.guard)
+
+    def guard(self, event: BeforeToolCallEvent) -> None:
+        if event.selected_tool is not None and not self.is_selected():
+            event.selected_tool = NotSelectedTool(event.selected_tool)
@@ -1,9 +1,20 @@
+import asyncio
 import base64
 import json
 import os
+import secrets
 import shutil
+import threading
+import time
 from uuid import uuid4
 
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+SORT_KEY_RANDOM_BITS = 80
+
+_sort_key_lock = threading.Lock()
+_last_sort_key_ms = 0
+_last_sort_key_random = 0
+
 
 def str_to_base64(s: str):
     return base64.b64encode(s.encode("utf-8")).decode("utf-8")
@@ -13,10 +24,57 @@ def base64_to_str(b: str):
     return base64.b64decode(b.encode("utf-8")).decode("utf-8")
 
 
+def encode_crockford_base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD_BASE32[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def generate_sort_key() -> str:
+    """Generate a collision-free, monotonic and lexicographically sortable sort key
+
+    The key is ULID-style: a millisecond timestamp followed by 80 bits of randomness
+    encoded in Crockford base32. Keys generated within the same millisecond increment
+    the random part, so they stay strictly increasing within the process.
+
+    The timestamp is written as 13 decimal digits so that the new keys keep sorting
+    after the legacy second-precision keys (e.g. "1730000000").
+
+    Returns:
+        Sort key string for the orderBy attribute
+    """
+    global _last_sort_key_ms, _last_sort_key_random
+
+    with _sort_key_lock:
+        now_ms = int(time.time() * 1000)
+
+        if now_ms > _last_sort_key_ms:
+            _last_sort_key_ms = now_ms
+            _last_sort_key_random = secrets.randbits(SORT_KEY_RANDOM_BITS)
+        else:
+            _last_sort_key_random += 1
+
+            if _last_sort_key_random >= 1 << SORT_KEY_RANDOM_BITS:
+                _last_sort_key_ms += 1
+                _last_sort_key_random = secrets.randbits(SORT_KEY_RANDOM_BITS)
+
+        return f"{_last_sort_key_ms:013d}{encode_crockford_base32(_last_sort_key_random, SORT_KEY_RANDOM_BITS // 5)}"
+
+
 def stream_chunk(text):
     return json.dumps({"text": text}, ensure_ascii=False) + "\n"
 
 
+def stream_queue_position_chunk(position: int):
+    return json.dumps({"text": "", "queuePosition": position}, ensure_ascii=False) + "\n"
+
+
+def stream_cache_hit_chunk(tool_name: str):
+    return json.dumps({"text": "", "cacheHit": tool_name}, ensure_ascii=False) + "\n"
+
+
 def generate_session_id() -> str:
     """Generate a unique session ID"""
     return str(uuid4())
@@ -70,12 +128,41 @@ def generate_session_system_prompt(session_workspace_dir: str) -> str:
 """
 
 
+async def run_to_completion(coro):
+    """Await a coroutine that must not be interrupted, such as the cleanup of a stopped stream
+
+    The coroutine runs in its own task. When the caller is cancelled (again) while waiting,
+    it keeps waiting for the task to finish, then raises CancelledError.
+    """
+    task = asyncio.ensure_future(coro)
+    cancelled = False
+
+    while True:
+        try:
+            result = await asyncio.shield(task)
+            break
+        except asyncio.CancelledError:
+            if task.done():
+                raise
+            cancelled = True
+
+    if cancelled:
+        raise asyncio.CancelledError()
+
+    return result
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """Check whether the error means Bedrock is throttling or overloaded"""
+    return "ServiceUnavailableException" in str(error) or "throttl" in str(error).lower() or type(error).__name__ in ("ModelThrottledException", "StreamThrottledError")
+
+
 def handle_error_and_stream(error: Exception) -> str:
     """Convert error to appropriate message and return in stream_chunk format"""
     error_message = ""
 
     # Bedrock related errors
-    if "ServiceUnavailableException" in str(error) or "throttling" in str(error).lower():
+    if is_throttling_error(error):
         error_message = "Sorry, the AI service is currently experiencing high traffic. Please try again in a few moments."
     elif "ValidationException" in str(error):
         error_message = "There's an issue with the request format. Please check your input."
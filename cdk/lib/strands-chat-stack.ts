@@ -103,6 +103,13 @@ export class StrandsChatStack extends cdk.Stack {
 
     const fileBucket = new Bucket(this, 'FileBucket', bucketCommonProps);
 
+    if (props.parameter.chatRetentionDays) {
+      // Same retention as the items in the table (expiresAt)
+      fileBucket.addLifecycleRule({
+        expiration: cdk.Duration.days(props.parameter.chatRetentionDays),
+      });
+    }
+
     fileBucket.addCorsRule({
       allowedOrigins: ['*'],
       allowedMethods: [HttpMethods.GET, HttpMethods.POST, HttpMethods.PUT],
@@ -125,6 +132,8 @@ export class StrandsChatStack extends cdk.Stack {
         type: AttributeType.STRING,
       },
       billingMode: BillingMode.PAY_PER_REQUEST,
+      // Epoch seconds after which DynamoDB deletes the item (short-lived stream records)
+      timeToLiveAttribute: 'expiresAt',
     });
 
     const resourceIndexName = 'ResourceIndex';
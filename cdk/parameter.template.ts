@@ -10,6 +10,11 @@ export const parameter: Parameter = {
 
   // Models available for users to select in the UI
   // Each model can specify a display name and region
+  // Optionally, `regions` lists additional regions serving the same model ID.
+  // The API routes each request to the region with the best recent latency and
+  // error rate, and fails over or hedges to another region before the first token.
+  // Optionally, `s3Location` tells whether the model reads attachments directly
+  // from S3 (Amazon Nova models do). Otherwise the API sends the file bytes.
   // Model access must be enabled in the respective regions
   models: [
     {
@@ -54,4 +59,10 @@ export const parameter: Parameter = {
   // Default: 10 concurrent executions to minimize cold start latency
   // Set to 0 to disable provisioned concurrency
   provisionedConcurrency: 5,
+
+  // Retention policy for chat data
+  // Chats, messages, gallery items and uploaded files are deleted this many days after they are written (at midnight UTC)
+  // A chat is kept for this many days after its last message
+  // Set to null to keep them until they are deleted from the UI or API
+  chatRetentionDays: null,
 };
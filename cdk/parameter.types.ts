@@ -3,6 +3,10 @@ import { z } from 'zod';
 const ModelSchema = z.object({
   id: z.string(),
   region: z.string(),
+  // Additional regions serving the same model, used for failover and hedging
+  regions: z.array(z.string()).optional(),
+  // Whether the model reads attachments from S3 (s3Location). Detected from the model ID when omitted.
+  s3Location: z.boolean().optional(),
   displayName: z.string().optional(),
 });
 
@@ -18,6 +22,13 @@ export const ParameterSchema = z.object({
     .int('Provisioned concurrency must be an integer')
     .min(0, 'Provisioned concurrency must be at least 0')
     .max(1000, 'Provisioned concurrency must not exceed 1000'),
+  // Days after which chats, messages, gallery items and uploaded files are deleted. Kept forever when omitted.
+  chatRetentionDays: z
+    .number()
+    .int('Chat retention must be an integer')
+    .min(1, 'Chat retention must be at least 1 day')
+    .nullable()
+    .optional(),
 });
 
 export type Parameter = z.infer<typeof ParameterSchema>;
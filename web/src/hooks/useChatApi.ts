@@ -5,6 +5,8 @@ import {
   type ChatInTable,
   type MessageInTable,
   type MessageNotInTable,
+  type MessageUpdate,
+  type MessageUpdateResult,
   type MessageWillBeInTable,
   type Pagination,
   type ToolSelectionResponse,
@@ -73,24 +75,29 @@ const useChatApi = () => {
     return await res.json();
   };
 
+  // Resolves with a conflict result for each message edited by someone else since it was read (409)
   const updateMessages = async (
     resourceId: string,
-    messages: MessageInTable[]
-  ): Promise<MessageInTable[]> => {
+    messages: MessageUpdate[]
+  ): Promise<MessageUpdateResult[]> => {
     const res = await httpRequest(
       `${apiEndpoint}chat/${resourceId}/messages`,
       'PUT',
       JSON.stringify({ messages })
     );
-    if (!res.ok) {
+    if (!res.ok && res.status !== 409) {
       throw new Error(`Failed to update messages: ${res.status}`);
     }
     return await res.json();
   };
 
-  const getMessages = async (resourceId: string): Promise<MessageInTable[]> => {
+  const getMessages = async (
+    resourceId: string,
+    since?: string
+  ): Promise<MessageInTable[]> => {
+    const query = since ? `?since=${encodeURIComponent(since)}` : '';
     const res = await httpRequest(
-      `${apiEndpoint}chat/${resourceId}/messages`,
+      `${apiEndpoint}chat/${resourceId}/messages${query}`,
       'GET'
     );
     if (!res.ok) {
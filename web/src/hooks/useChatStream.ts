@@ -32,12 +32,29 @@ const useChatStream = () => {
       assistantMessage,
     });
 
-    const res = await httpRequest(`${apiEndpoint}streaming`, 'POST', req);
+    // 503 while the serving process shuts down or is overloaded. The request is idempotent
+    // on the assistant message, so it is sent again (to another instance or worker).
+    let res = await httpRequest(`${apiEndpoint}streaming`, 'POST', req);
+    for (let attempt = 0; res.status === 503 && attempt < 3; attempt++) {
+      const retryAfter = Number(res.headers.get('Retry-After') ?? '1');
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+      res = await httpRequest(`${apiEndpoint}streaming`, 'POST', req);
+    }
+
+    if (res.status === 503) {
+      yield {
+        text: 'Sorry, the AI service is currently experiencing high traffic. Please try again in a few moments.',
+      };
+      return;
+    }
+
     const stream = res!.body!.pipeThrough(new TextDecoderStream());
 
     // eslint-disable-next-line @typescript-eslint/no-explicit-any
     let error: any = null;
     let chatsReloaded = false;
+    // A read may end in the middle of a line (e.g. with compressed responses)
+    let incompleteLine = '';
 
     for await (const chunk of stream) {
       if (!chatsReloaded) {
@@ -45,7 +62,8 @@ const useChatStream = () => {
         chatsReloaded = true;
       }
 
-      const chunkJsonL = chunk.split('\n');
+      const chunkJsonL = (incompleteLine + chunk).split('\n');
+      incompleteLine = chunkJsonL.pop() ?? '';
 
       for (const chunkJson of chunkJsonL) {
         if (chunkJson.length > 0) {
@@ -67,8 +85,23 @@ const useChatStream = () => {
     }
   };
 
+  const cancelStream = async (
+    resourceId: string,
+    assistantMessageId: string
+  ): Promise<void> => {
+    const res = await httpRequest(
+      `${apiEndpoint}streaming/${resourceId}/cancel`,
+      'POST',
+      JSON.stringify({ assistantMessageId })
+    );
+    if (!res.ok) {
+      throw new Error(`Failed to cancel streaming: ${res.status}`);
+    }
+  };
+
   return {
     postNewMessage,
+    cancelStream,
   };
 };
 
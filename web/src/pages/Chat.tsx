@@ -25,6 +25,14 @@ import ToolsBottomSheet from '../components/ToolsBottomSheet';
 import Tooltip from '../components/Tooltip';
 import { type Model } from '../types/parameter';
 
+// Returns the orderBy of the newest message already synchronized with the database
+const getLastOrderBy = (messages: MessageShown[]): string | undefined => {
+  return messages.reduce<string | undefined>(
+    (last, m) => (m.orderBy && (!last || m.orderBy > last) ? m.orderBy : last),
+    undefined
+  );
+};
+
 type ChatState = {
   newChat: boolean;
   model?: Model;
@@ -53,7 +61,7 @@ function Chat() {
   } = useScreen();
 
   const { getMessages: getMessagesInDb } = useChatApi();
-  const { postNewMessage } = useChatStream();
+  const { postNewMessage, cancelStream } = useChatStream();
 
   const { filetype, upload, supportedExtensions } = useFile();
   const { parameter } = useParameter();
@@ -131,11 +139,22 @@ function Chat() {
         setLoading(true);
 
         try {
-          const messagesInDb = await getMessagesInDb(chatId);
           const messagesInState = getMessagesInState();
+          const since = getLastOrderBy(messagesInState);
 
-          if (messagesInDb.length >= messagesInState.length) {
-            setMessages(messagesInDb);
+          if (since && messagesInState.every((m) => m.orderBy)) {
+            // Every message in state is already stored, so fetch only the newer ones
+            const newMessagesInDb = await getMessagesInDb(chatId, since);
+
+            if (newMessagesInDb.length > 0) {
+              setMessages([...messagesInState, ...newMessagesInDb]);
+            }
+          } else {
+            const messagesInDb = await getMessagesInDb(chatId);
+
+            if (messagesInDb.length >= messagesInState.length) {
+              setMessages(messagesInDb);
+            }
           }
         } catch (e) {
           console.error(e);
@@ -265,8 +284,12 @@ function Chat() {
 
       // Synchronize messages with database after streaming completes
       try {
-        const messagesInDb = await getMessagesInDb(chatId!);
         const currentMessages = getMessagesInState();
+        // Only the messages saved by this stream are needed for synchronization
+        const messagesInDb = await getMessagesInDb(
+          chatId!,
+          getLastOrderBy(currentMessages)
+        );
 
         // Create a map of database messages by resourceId for efficient lookup
         const dbMessageMap = new Map(
@@ -358,8 +381,12 @@ function Chat() {
 
       // Synchronize messages with database after streaming completes
       try {
-        const messagesInDb = await getMessagesInDb(chatId!);
         const currentMessages = getMessagesInState();
+        // Only the messages saved by this stream are needed for synchronization
+        const messagesInDb = await getMessagesInDb(
+          chatId!,
+          getLastOrderBy(currentMessages)
+        );
 
         // Create a map of database messages by resourceId for efficient lookup
         const dbMessageMap = new Map(
@@ -420,6 +447,20 @@ function Chat() {
     setInputFiles([]);
   };
 
+  // The stream ends by itself once the server has saved the partial answer
+  const stopStreaming = async () => {
+    const currentMessages = getMessagesInState();
+    const lastMessage = currentMessages[currentMessages.length - 1];
+
+    if (!chatId || !lastMessage?.resourceId) return;
+
+    try {
+      await cancelStream(chatId, lastMessage.resourceId);
+    } catch (e) {
+      console.error('Failed to stop streaming:', e);
+    }
+  };
+
   const handleFileChange = async (e: React.ChangeEvent<HTMLInputElement>) => {
     const files = e.target.files ?? [];
 
@@ -804,28 +845,43 @@ function Chat() {
                 </span>
               </button>
 
-              <button
-                className="ml-auto cursor-pointer rounded bg-blue-500 p-2 text-white transition-colors duration-300 hover:bg-blue-600 focus:outline-none active:bg-blue-700 disabled:cursor-not-allowed disabled:opacity-50 disabled:hover:bg-blue-500 dark:bg-blue-600 dark:hover:bg-blue-700 dark:active:bg-blue-800 dark:disabled:hover:bg-blue-600"
-                onClick={createOrContinueChat}
-                disabled={
-                  loading ||
-                  streaming ||
-                  isSelecting ||
-                  userInput.trim().length === 0
-                }>
-                <svg
-                  className="h-5 w-5 transition-colors duration-300"
-                  fill="none"
-                  stroke="currentColor"
-                  viewBox="0 0 24 24">
-                  <path
-                    strokeLinecap="round"
-                    strokeLinejoin="round"
-                    strokeWidth={2}
-                    d="M12 19l9 2-9-18-9 18 9-2zm0 0v-8"
-                  />
-                </svg>
-              </button>
+              {streaming ? (
+                <Tooltip content="Stop" className="ml-auto">
+                  <button
+                    className="cursor-pointer rounded bg-red-500 p-2 text-white transition-colors duration-300 hover:bg-red-600 focus:outline-none active:bg-red-700 dark:bg-red-600 dark:hover:bg-red-700 dark:active:bg-red-800"
+                    onClick={stopStreaming}>
+                    <svg
+                      className="h-5 w-5 transition-colors duration-300"
+                      fill="currentColor"
+                      viewBox="0 0 24 24">
+                      <rect x="6" y="6" width="12" height="12" rx="1" />
+                    </svg>
+                  </button>
+                </Tooltip>
+              ) : (
+                <button
+                  className="ml-auto cursor-pointer rounded bg-blue-500 p-2 text-white transition-colors duration-300 hover:bg-blue-600 focus:outline-none active:bg-blue-700 disabled:cursor-not-allowed disabled:opacity-50 disabled:hover:bg-blue-500 dark:bg-blue-600 dark:hover:bg-blue-700 dark:active:bg-blue-800 dark:disabled:hover:bg-blue-600"
+                  onClick={createOrContinueChat}
+                  disabled={
+                    loading ||
+                    streaming ||
+                    isSelecting ||
+                    userInput.trim().length === 0
+                  }>
+                  <svg
+                    className="h-5 w-5 transition-colors duration-300"
+                    fill="none"
+                    stroke="currentColor"
+                    viewBox="0 0 24 24">
+                    <path
+                      strokeLinecap="round"
+                      strokeLinejoin="round"
+                      strokeWidth={2}
+                      d="M12 19l9 2-9-18-9 18 9-2zm0 0v-8"
+                    />
+                  </svg>
+                </button>
+              )}
             </div>
           </div>
 
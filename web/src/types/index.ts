@@ -24,21 +24,63 @@ export type FileContent = {
   name: string;
   s3Key: string;
   displayName: string;
+  // Set by the API when the attachment is preprocessed (downscaled image or extracted text)
+  derivedS3Key?: string;
+  derivedExtension?: string;
+  derivedVersion?: string;
 };
 
 export type ContentBlock = TextContent | FileContent;
 
 export type Role = 'user' | 'assistant' | 'system';
 
+// Token usage and timing of an assistant message
+export type MessageUsage = {
+  modelId: string;
+  modelRegion: string;
+  inputTokens: number;
+  outputTokens: number;
+  totalTokens: number;
+  cacheReadInputTokens: number;
+  cacheWriteInputTokens: number;
+  latencyMs: number;
+  modelCalls: number;
+  durationMs: number;
+  ttftMs?: number;
+};
+
 export type MessageNotInTable = {
   role: Role;
   content: ContentBlock[];
   tools?: string[] | null;
+  usage?: MessageUsage | null;
 };
 
 export type MessageShown = MessageNotInTable & Partial<InTable>;
 
-export type MessageInTable = MessageNotInTable & InTable;
+export type MessageInTable = MessageNotInTable &
+  InTable & {
+    // Incremented by every update (absent until the first one)
+    version?: number;
+  };
+
+// Changed fields of a message. Fields left out are not updated.
+export type MessageUpdate = {
+  orderBy: string;
+  // Version the change is based on (0 for messages never updated)
+  version: number;
+  role?: Role;
+  content?: ContentBlock[];
+  // Replaces single content blocks by index
+  contentBlocks?: Record<number, ContentBlock>;
+  tools?: string[] | null;
+};
+
+export type MessageUpdateResult = {
+  orderBy: string;
+  status: 'updated' | 'conflict' | 'outOfRange' | 'notFound';
+  version?: number;
+};
 
 export type MessageWillBeInTable = MessageNotInTable & {
   resourceId: string;
@@ -51,6 +93,10 @@ export type Pagination<T> = {
 
 export type StreamChunk = {
   text: string;
+  // Sent while the request waits for a free stream slot on the server
+  queuePosition?: number;
+  // Name of the tool whose result was served from the server-side cache
+  cacheHit?: string;
 };
 
 export type ToolSelectionRequest = {